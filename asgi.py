@@ -0,0 +1,73 @@
+import json
+from urllib.parse import parse_qs
+
+import engine
+from recipe_scraper import app, get_recipe_json, recipe_response, RecipeError
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+
+# Run with an ASGI server, e.g. `uvicorn asgi:application`. /recipe is served
+# natively on the event loop so one process can keep hundreds of scrapes in
+# flight; every other route falls through to the Flask app when asgiref is
+# installed.
+flask_app = WsgiToAsgi(app) if WsgiToAsgi else None
+
+
+async def send_response(send, status, body, content_type='application/json', headers=()):
+    body = body.encode('utf-8') if isinstance(body, str) else body
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type.encode('latin-1')),
+            (b'content-length', str(len(body)).encode('latin-1')),
+            *((name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            engine.get_loop()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            engine.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def recipe_endpoint(scope, receive, send):
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    url = query.get('url', [None])[0]
+    if not url:
+        return await send_response(send, 400, json.dumps({"error": "No URL provided"}))
+    try:
+        payload = await engine.run_async(get_recipe_json(url))
+    except RecipeError as e:
+        return await send_response(send, e.status_code, json.dumps({"error": e.message}))
+    except Exception as e:
+        return await send_response(send, 502, json.dumps({"error": f"Error fetching recipe: {str(e)}"}))
+    request_headers = dict(scope.get('headers', ()))
+    status, body, headers = recipe_response(
+        payload,
+        query.get('pretty', [''])[0].lower() in ('1', 'true', 'yes'),
+        request_headers.get(b'accept-encoding', b'').decode('latin-1'),
+        request_headers.get(b'if-none-match', b'').decode('latin-1'))
+    await send_response(send, status, body, 'text/html; charset=utf-8', headers)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http' and scope['path'] == '/recipe' and scope['method'] in ('GET', 'HEAD'):
+        return await recipe_endpoint(scope, receive, send)
+    if flask_app is not None:
+        return await flask_app(scope, receive, send)
+    await send_response(send, 404, json.dumps({"error": "Not found"}))
@@ -0,0 +1,413 @@
+import argparse
+import contextlib
+import glob
+import json
+import os
+import statistics
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import canonical_url
+import engine
+import http_client
+from host_scheduler import HostScheduler
+import json_codec
+import jsonld
+
+
+SAMPLE_RECIPE = {
+    "@context": "https://schema.org",
+    "@type": "Recipe",
+    "name": "Benchmark Banana Bread",
+    "description": "A stand-in recipe served by the local benchmark server.",
+    "prepTime": "PT15M",
+    "cookTime": "PT1H5M",
+    "recipeYield": "8 servings",
+    "image": {"@type": "ImageObject", "url": "https://example.com/banana-bread.jpg"},
+    "recipeIngredient": ["3 ripe bananas", "1/3 cup melted butter", "1 tsp baking soda",
+                         "3/4 cup sugar", "1 large egg", "1 tsp vanilla", "1 1/2 cups flour"],
+    "recipeInstructions": [{"@type": "HowToStep", "text": f"Step number {i}."} for i in range(1, 9)],
+}
+
+
+def sample_page(padding_kb=150):
+    filler = '<div class="comment"><p>%s</p></div>' % ('lorem ipsum ' * 40)
+    body = filler * max(1, padding_kb * 1024 // len(filler))
+    return (
+        '<!DOCTYPE html><html><head><title>Benchmark</title>'
+        '<script type="application/ld+json">%s</script></head>'
+        '<body>%s</body></html>' % (json.dumps(SAMPLE_RECIPE, indent=2), body)
+    ).encode('utf-8')
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients that stop reading early reset the connection; that is the
+        # point of some benchmarks, not an error.
+        pass
+
+
+class StandInServer:
+    # A local keep-alive HTTP/1.1 server. `connect_delay` is paid once per new
+    # TCP connection to model the handshake cost of a remote TLS host.
+    def __init__(self, page, connect_delay=0.0):
+        page_bytes = page
+        delay = connect_delay
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                if delay:
+                    time.sleep(delay)
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(page_bytes)))
+                self.end_headers()
+                self.wfile.write(page_bytes)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = QuietHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/recipes/benchmark-banana-bread'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def report(label, samples):
+    print(f'{label:<28} n={len(samples):<5} '
+          f'p50={percentile(samples, 50) * 1000:8.2f} ms  '
+          f'p99={percentile(samples, 99) * 1000:8.2f} ms  '
+          f'mean={statistics.mean(samples) * 1000:8.2f} ms')
+
+
+def time_calls(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+@contextlib.contextmanager
+def unpaced():
+    # Every iteration hits the same stand-in host, so the per-host rate limit
+    # would otherwise be what gets timed
+    original = http_client.host_scheduler
+    http_client.host_scheduler = HostScheduler(rate=1e9, burst=1e9, rates={})
+    try:
+        yield
+    finally:
+        http_client.host_scheduler = original
+
+
+def bench_session(args):
+    import recipe_scraper
+
+    extractor = recipe_scraper.site_extractors.default
+    with StandInServer(sample_page(args.page_kb), args.connect_delay) as server, unpaced():
+        url = server.url
+        print(f'stand-in server: {url} (connect delay {args.connect_delay * 1000:.0f} ms, '
+              f'page {args.page_kb} KB)')
+
+        report('requests.get (no reuse)', time_calls(lambda: requests.get(url), args.iterations))
+        http_client.close_session()
+        report('pooled session', time_calls(lambda: http_client.http_get(url), args.iterations))
+
+        report('default extractor', time_calls(lambda: engine.run(extractor.extract(url)), args.iterations))
+
+
+URL_VARIANTS = [
+    'https://tasty.co/recipe/one-pot-garlic-parmesan-pasta',
+    'http://www.tasty.co/recipe/one-pot-garlic-parmesan-pasta/?utm_source=facebook&utm_medium=social',
+    'HTTPS://Tasty.co:443//recipe/one-pot-garlic-parmesan-pasta#comments',
+    'https://www.resepichenom.com/resepi/ayam-masak-merah/show?fbclid=IwAR0abc',
+    'https://www.kingarthurbaking.com/recipes/classic-sandwich-bread-recipe?gclid=xyz&ref=home',
+    'https://www.example.com/recipes/banana-bread/?id=42&utm_campaign=spring&print=1&_ga=2.1',
+]
+
+
+def bench_stream(args):
+    import recipe_scraper
+
+    extractor = recipe_scraper.site_extractors.default
+    with StandInServer(sample_page(args.page_kb), args.connect_delay) as server, unpaced():
+        url = server.url
+        print(f'stand-in server: {url} (page {args.page_kb} KB, JSON-LD in <head>)')
+        original = http_client.HTTP_STREAM_PAGES
+        try:
+            for streamed in (False, True):
+                http_client.HTTP_STREAM_PAGES = streamed
+                http_client.fetch_stats.clear()
+                samples = time_calls(lambda: engine.run(extractor.extract(url)), args.iterations)
+                label = 'streamed, early stop' if streamed else 'full body'
+                report(label, samples)
+                if streamed:
+                    per_page = http_client.fetch_stats['bytes_read'] / args.iterations
+                    print(f'{"":<28} {per_page / 1024:.1f} KB read per page')
+        finally:
+            http_client.HTTP_STREAM_PAGES = original
+
+
+def bench_canonical(args):
+    iterations = args.iterations * 100
+    # 1000 distinct page ids across the variants, so the LRU sees a hot set
+    urls = []
+    for i in range(iterations):
+        url = URL_VARIANTS[i % len(URL_VARIANTS)]
+        urls.append(f'{url}{"&" if "?" in url else "?"}n={i % 1000}')
+    uncached = canonical_url.canonicalize.__wrapped__
+
+    start = time.perf_counter()
+    for url in urls:
+        uncached(url)
+    elapsed = time.perf_counter() - start
+    print(f'canonicalize (uncached)      {len(urls) / elapsed:12,.0f} urls/s  '
+          f'{elapsed / len(urls) * 1e6:6.2f} us/url')
+
+    canonical_url.canonicalize.cache_clear()
+    start = time.perf_counter()
+    for url in urls:
+        canonical_url.canonicalize(url)
+    elapsed = time.perf_counter() - start
+    print(f'canonicalize (lru, 1k hot)   {len(urls) / elapsed:12,.0f} urls/s  '
+          f'{elapsed / len(urls) * 1e6:6.2f} us/url')
+
+    import recipe_scraper
+    start = time.perf_counter()
+    unique = recipe_scraper.dedupe_urls(urls)
+    elapsed = time.perf_counter() - start
+    print(f'dedupe_urls                  {len(urls):,} urls -> {len(unique):,} unique in {elapsed * 1000:.1f} ms')
+
+
+def synthetic_corpus():
+    # Stand-ins shaped like the real sites: tracking/analytics scripts and
+    # inline CSS before the JSON-LD, and a long body after it.
+    organization = json.dumps({"@context": "https://schema.org", "@type": "Organization", "name": "Example"})
+    graph = json.dumps({"@context": "https://schema.org", "@graph": [
+        {"@type": "WebPage", "@id": "https://example.com/#webpage"}, SAMPLE_RECIPE]})
+    head_noise = ''.join('<script>window.dataLayer=window.dataLayer||[];dataLayer.push({"n":%d});</script>'
+                         '<style>.c%d{color:#%06x;margin:0 auto}</style>' % (i, i, i) for i in range(150))
+    body = sample_page(400).decode('utf-8').split('<body>', 1)[1]
+    return {
+        'tasty-like.html': '<html><head>%s<script type="application/ld+json">%s</script></head><body>%s' % (
+            head_noise, json.dumps(SAMPLE_RECIPE), body),
+        'chenom-like.html': '<html><head>%s<script type="application/ld+json">%s</script>'
+                            '<script type="application/ld+json">%s</script></head><body>%s' % (
+                                head_noise, organization, json.dumps([SAMPLE_RECIPE]), body),
+        'kingarthur-like.html': '<html><head>%s</head><body>%s<script type="application/ld+json">%s</script>'
+                                '</body></html>' % (head_noise, body.replace('</body></html>', ''), graph),
+    }
+
+
+def load_corpus(directory):
+    if not directory:
+        return synthetic_corpus()
+    corpus = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.html'))):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            corpus[os.path.basename(path)] = f.read()
+    return corpus
+
+
+def measure(fn, html, iterations):
+    tracemalloc.start()
+    result = fn(html)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    samples = time_calls(lambda: fn(html), iterations)
+    return result, statistics.median(samples), peak
+
+
+def bench_jsonld(args):
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    def full_soup(html):
+        script = BeautifulSoup(html, 'html.parser').find('script', type='application/ld+json')
+        return script.string if script else None
+
+    def strained_soup(html):
+        only_ld_json = SoupStrainer('script', type='application/ld+json')
+        script = BeautifulSoup(html, 'html.parser', parse_only=only_ld_json).find('script')
+        return script.string if script else None
+
+    def scanned(html):
+        # Stops at the first block instead of scanning the rest of the page
+        return next(jsonld.iter_ld_json(html), None)
+
+    extractors = [
+        ('BeautifulSoup (full tree)', full_soup),
+        ('BeautifulSoup + SoupStrainer', strained_soup),
+        ('jsonld.iter_ld_json', scanned),
+    ]
+    corpus = load_corpus(args.corpus)
+    iterations = max(1, args.iterations // 20)
+    for name, html in corpus.items():
+        print(f'{name} ({len(html) / 1024:.0f} KB)')
+        expected = None
+        for label, fn in extractors:
+            result, median, peak = measure(fn, html, iterations)
+            expected = result if expected is None else expected
+            same = 'ok' if result == expected else 'MISMATCH'
+            print(f'  {label:<30} {median * 1000:9.2f} ms  peak {peak / 1024 / 1024:7.2f} MB  {same}')
+
+
+def recipe_outputs(corpus):
+    import recipe_scraper
+
+    outputs = {}
+    for name, html in corpus.items():
+        for extractor in (recipe_scraper.TastyExtractor(), recipe_scraper.ChenomExtractor(),
+                          recipe_scraper.KingArthurBakingExtractor(), recipe_scraper.RecipeExtractor()):
+            try:
+                outputs[name, extractor.name] = extractor.parse(html, 'https://example.com/' + name).to_json()
+            except recipe_scraper.RecipeError as e:
+                outputs[name, extractor.name] = f'{e.status_code} {e.message}'
+    return outputs
+
+
+def bench_parsers(args):
+    # Throughput of each installed JSON-LD backend, plus a parity check that
+    # every backend yields identical Recipe output for every parser and page.
+    corpus = load_corpus(args.corpus)
+    total_bytes = sum(len(html) for html in corpus.values())
+    iterations = max(1, args.iterations // 20)
+    original = jsonld.backend
+    reference = None
+    try:
+        for name in sorted(jsonld.BACKENDS):
+            jsonld.set_backend(name)
+            start = time.perf_counter()
+            for _ in range(iterations):
+                for html in corpus.values():
+                    jsonld.extract_ld_json(html)
+            elapsed = time.perf_counter() - start
+            pages = iterations * len(corpus)
+            outputs = recipe_outputs(corpus)
+            if reference is None:
+                reference = outputs
+            mismatches = [key for key, value in outputs.items() if reference.get(key) != value]
+            print(f'{name:<12} {pages / elapsed:10.1f} pages/s  '
+                  f'{total_bytes * iterations / elapsed / 1024 / 1024:8.1f} MB/s  '
+                  f'parity: {"ok" if not mismatches else "MISMATCH " + repr(mismatches[:3])}')
+    finally:
+        jsonld.set_backend(original)
+    missing = {'selectolax', 'lxml'} - set(jsonld.BACKENDS)
+    if missing:
+        print(f'not installed: {", ".join(sorted(missing))}')
+
+
+def bulky_recipe(reviews=400):
+    # The kind of JSON-LD that makes decoding matter: reviews, a video object
+    # and nutrition embedded alongside the recipe, with raw newlines in text.
+    recipe = dict(SAMPLE_RECIPE)
+    recipe["nutrition"] = {"@type": "NutritionInformation", "calories": "240 kcal", "fatContent": "9 g"}
+    recipe["video"] = {"@type": "VideoObject", "name": "How to make it", "description": "Line one\nline two " * 20}
+    recipe["review"] = [{
+        "@type": "Review", "author": {"@type": "Person", "name": f"Reviewer {i}"},
+        "reviewRating": {"@type": "Rating", "ratingValue": i % 5 + 1},
+        "reviewBody": "Turned out great.\nWould bake again, with less sugar. " * 4,
+    } for i in range(reviews)]
+    return json.dumps(recipe, ensure_ascii=False).replace('\\n', '\n')
+
+
+def bench_json(args):
+    # Decode throughput on the JSON-LD blocks of the corpus pages (plus one
+    # bulky block), and encode throughput on the resulting Recipe dicts.
+    import recipe_scraper
+
+    fixtures = {
+        'page blocks': [block for html in load_corpus(args.corpus).values() for block in jsonld.extract_ld_json(html)],
+        'bulky block': [bulky_recipe()],
+    }
+    iterations = max(1, args.iterations // 10)
+
+    decoders = [('json + replace (old)', lambda text: json.loads(text.replace('\n', ' ').replace('\r', ' ')))]
+    decoders += [(name, loads) for name, (loads, _) in sorted(json_codec.BACKENDS.items())]
+    for fixture, blocks in fixtures.items():
+        total_bytes = sum(len(block.encode('utf-8')) for block in blocks)
+        print(f'{fixture} ({total_bytes / 1024:.0f} KB)')
+        reference = None
+        for label, loads in decoders:
+            samples = time_calls(lambda: [loads(block) for block in blocks], iterations)
+            decoded = [loads(block) for block in blocks]
+            if label in json_codec.BACKENDS:
+                reference = decoded if reference is None else reference
+                same = 'ok' if decoded == reference else 'MISMATCH'
+            else:
+                same = '-'
+            print(f'  decode {label:<22} {total_bytes / statistics.median(samples) / 1024 / 1024:8.1f} MB/s  '
+                  f'parity: {same}')
+
+    recipes = []
+    for html in load_corpus(args.corpus).values():
+        try:
+            recipes.append(recipe_scraper.site_extractors.default.parse(html, 'https://example.com/').to_dict())
+        except recipe_scraper.RecipeError:
+            pass
+    print(f'recipes ({len(recipes)})')
+    encoders = [('json indent=4 (old)', lambda obj: json.dumps(obj, sort_keys=False, indent=4).encode('utf-8'))]
+    for name, (_, dumpb) in sorted(json_codec.BACKENDS.items()):
+        encoders.append((f'{name} pretty', lambda obj, dumpb=dumpb: dumpb(obj, True)))
+        encoders.append((f'{name} compact', lambda obj, dumpb=dumpb: dumpb(obj)))
+    for label, encode in encoders:
+        samples = time_calls(lambda: [encode(recipe) for recipe in recipes], iterations * 10)
+        size = sum(len(encode(recipe)) for recipe in recipes)
+        print(f'  encode {label:<22} {len(recipes) / statistics.median(samples):10.0f} recipes/s  '
+              f'{size / max(1, len(recipes)):7.0f} bytes each')
+    if 'orjson' not in json_codec.BACKENDS:
+        print('not installed: orjson')
+
+
+BENCHMARKS = {
+    'session': bench_session,
+    'canonical': bench_canonical,
+    'jsonld': bench_jsonld,
+    'parsers': bench_parsers,
+    'stream': bench_stream,
+    'json': bench_json,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recipe scraper micro-benchmarks')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    parser.add_argument('--page-kb', type=int, default=150,
+                        help='size of the filler HTML served by the stand-in server')
+    parser.add_argument('--connect-delay', type=float, default=0.02,
+                        help='seconds the stand-in server waits on each new connection')
+    parser.add_argument('--corpus', help='directory of saved recipe pages (*.html); synthetic pages if omitted')
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
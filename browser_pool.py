@@ -0,0 +1,237 @@
+import atexit
+import collections
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+
+
+load_dotenv()
+
+BROWSER_POOL_SIZE = int(os.getenv('BROWSER_POOL_SIZE', 2))
+# Browsers are restarted after this many pages to cap memory growth.
+BROWSER_MAX_PAGES = int(os.getenv('BROWSER_MAX_PAGES', 50))
+BROWSER_LEASE_TIMEOUT = float(os.getenv('BROWSER_LEASE_TIMEOUT', 30))
+BROWSER_PAGE_LOAD_TIMEOUT = float(os.getenv('BROWSER_PAGE_LOAD_TIMEOUT', 30))
+BROWSER_PREWARM = int(os.getenv('BROWSER_PREWARM', 0))
+# Lean mode: eager page loads with images, fonts, stylesheets, media and
+# known ad/analytics hosts blocked. We only ever read the JSON-LD.
+BROWSER_LEAN_MODE = os.getenv('BROWSER_LEAN_MODE', 'true').lower() in ('1', 'true', 'yes')
+BLOCKED_URL_PATTERNS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.avif', '*.svg', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.css', '*.mp4', '*.webm', '*.m3u8',
+    '*googletagmanager.com*', '*google-analytics.com*', '*doubleclick.net*',
+    '*googlesyndication.com*', '*adservice.google.*', '*amazon-adsystem.com*',
+    '*facebook.net*', '*connect.facebook.*', '*hotjar.com*', '*segment.io*',
+    '*cdn.segment.com*', '*optimizely.com*', '*newrelic.com*', '*nr-data.net*',
+    '*scorecardresearch.com*', '*quantserve.com*', '*taboola.com*', '*outbrain.com*',
+    '*pinterest.com/ct*', '*tiktok.com*', '*criteo.*', '*adnxs.com*', '*rubiconproject.com*',
+] + [pattern for pattern in os.getenv('BROWSER_BLOCKED_URLS', '').split(',') if pattern]
+
+
+class BrowserPoolTimeout(Exception):
+    pass
+
+
+def create_chrome():
+    options = webdriver.ChromeOptions()
+    options.add_argument('--headless=new')
+    options.add_argument('--disable-gpu')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--no-sandbox')
+    if BROWSER_LEAN_MODE:
+        # Return from driver.get() at DOMContentLoaded instead of onload
+        options.page_load_strategy = 'eager'
+        options.add_argument('--blink-settings=imagesEnabled=false')
+        options.add_experimental_option('prefs', {
+            'profile.managed_default_content_settings.images': 2,
+            'profile.managed_default_content_settings.stylesheets': 2,
+            'profile.managed_default_content_settings.fonts': 2,
+            'profile.managed_default_content_settings.media_stream': 2,
+        })
+    driver = webdriver.Chrome(options=options)
+    driver.set_page_load_timeout(BROWSER_PAGE_LOAD_TIMEOUT)
+    if BROWSER_LEAN_MODE:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+    return driver
+
+
+class PooledBrowser:
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.created_at = time.monotonic()
+
+
+class BrowserPool:
+    def __init__(self, size=BROWSER_POOL_SIZE, max_pages=BROWSER_MAX_PAGES,
+                 lease_timeout=BROWSER_LEASE_TIMEOUT, factory=create_chrome):
+        self.size = size
+        self.max_pages = max_pages
+        self.lease_timeout = lease_timeout
+        self.factory = factory
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._in_use = 0
+        self._waiting = 0
+        self._counters = collections.Counter()
+        self._wait_times = collections.deque(maxlen=1000)
+
+    def prewarm(self, count):
+        browsers = []
+        for _ in range(min(count, self.size)):
+            browsers.append(self._create())
+        with self._lock:
+            self._idle.extend(browsers)
+
+    @contextmanager
+    def lease(self, timeout=None):
+        browser = self._acquire(self.lease_timeout if timeout is None else timeout)
+        healthy = True
+        try:
+            yield browser.driver
+        except WebDriverException:
+            healthy = False
+            raise
+        finally:
+            browser.pages += 1
+            self._release(browser, healthy)
+
+    def _acquire(self, timeout):
+        started = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        try:
+            if not self._slots.acquire(timeout=timeout):
+                self._count('lease_timeouts')
+                raise BrowserPoolTimeout(f'No browser available after {timeout}s')
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        try:
+            browser = self._take_idle()
+            if browser is None:
+                browser = self._create()
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._counters['leases'] += 1
+            self._wait_times.append(time.monotonic() - started)
+        return browser
+
+    def _take_idle(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                browser = self._idle.pop()
+            if self._is_healthy(browser):
+                return browser
+            self._count('health_check_failures')
+            self._quit(browser)
+
+    def _release(self, browser, healthy):
+        recycle = not healthy or browser.pages >= self.max_pages or self._closed
+        if not recycle:
+            try:
+                # Drop the previous page so an idle browser does not hold its DOM
+                browser.driver.get('about:blank')
+            except WebDriverException:
+                recycle = True
+        if recycle:
+            self._count('crashed' if not healthy else 'recycled')
+            self._quit(browser)
+        with self._lock:
+            self._in_use -= 1
+            if not recycle:
+                self._idle.append(browser)
+        self._slots.release()
+
+    def _create(self):
+        browser = PooledBrowser(self.factory())
+        self._count('created')
+        return browser
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _is_healthy(self, browser):
+        try:
+            return browser.driver.execute_script('return 1') == 1
+        except WebDriverException:
+            return False
+
+    def _quit(self, browser):
+        try:
+            browser.driver.quit()
+        except WebDriverException:
+            pass
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._wait_times)
+            in_use = self._in_use
+            idle = len(self._idle)
+            waiting = self._waiting
+            counters = dict(self._counters)
+
+        def pct(p):
+            return round(waits[min(len(waits) - 1, int(p / 100.0 * len(waits)))], 4) if waits else 0.0
+
+        return {
+            "size": self.size,
+            "in_use": in_use,
+            "idle": idle,
+            "waiting": waiting,
+            "utilization": round(in_use / self.size, 3) if self.size else 0.0,
+            "lease_wait_p50": pct(50),
+            "lease_wait_p99": pct(99),
+            "lease_wait_max": round(waits[-1], 4) if waits else 0.0,
+            "leases": counters.get('leases', 0),
+            "lease_timeouts": counters.get('lease_timeouts', 0),
+            "created": counters.get('created', 0),
+            "recycled": counters.get('recycled', 0),
+            "crashed": counters.get('crashed', 0),
+            "health_check_failures": counters.get('health_check_failures', 0),
+        }
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            browsers = list(self._idle)
+            self._idle.clear()
+        for browser in browsers:
+            self._quit(browser)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = BrowserPool()
+                if BROWSER_PREWARM:
+                    pool.prewarm(BROWSER_PREWARM)
+                _pool = pool
+    return _pool
+
+
+@atexit.register
+def close_pool():
+    if _pool is not None:
+        _pool.close()
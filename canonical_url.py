@@ -0,0 +1,118 @@
+import re
+from functools import lru_cache
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+
+# Query parameters that never change which page is served.
+TRACKING_PARAMS = frozenset([
+    'fbclid', 'gclid', 'gclsrc', 'dclid', 'msclkid', 'yclid', 'twclid', 'ttclid', 'igshid', 'li_fat_id',
+    'mc_cid', 'mc_eid', '_ga', '_gl', '_hsenc', '_hsmi', 'hsctatracking', 'mkt_tok', 'oly_anon_id',
+    'oly_enc_id', 'vero_conv', 'vero_id', 'wickedid', 'ref', 'ref_src', 'ref_url', 'referrer', 'source',
+    'spm', 'cmpid', 's_cid', 'campaign', 'share', 'shared', 'amp', 'nc', 'ncid', 'sr_share', 'via',
+    'ito', 'int_source', 'int_medium', 'int_campaign', 'action_object_map', 'action_type_map',
+    'action_ref_map', 'epik', 'rb_clickid', 'soc_src', 'soc_trk', 'utm',
+])
+TRACKING_PREFIXES = ('utm_', 'pk_', 'mtm_', 'hmb_', 'ga_', 'trk_', 'at_', 'ns_', 'itm_', 'fb_')
+
+# Per-host rules for the sites we know. `query` is the set of query
+# parameters that identify a recipe on that host; None keeps every
+# non-tracking parameter.
+HOST_RULES = {
+    'tasty.co': {'query': frozenset()},
+    'resepichenom.com': {'query': frozenset()},
+    'kingarthurbaking.com': {'query': frozenset()},
+}
+DEFAULT_RULE = {'query': None}
+
+HOST_PREFIXES = ('www.', 'www2.', 'www3.')
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+DUPLICATE_SLASHES = re.compile(r'/{2,}')
+
+CANONICAL_LINK = re.compile(
+    r'<link\b[^>]*?\brel\s*=\s*["\']?canonical\b[^>]*>', re.IGNORECASE)
+HREF = re.compile(r'(?<![\w-])href\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def canonical_host(netloc):
+    host = netloc.rpartition('@')[2].lower().rstrip('.')
+    port = ''
+    if host.startswith('['):
+        bracket = host.find(']')
+        host, port = host[:bracket + 1], host[bracket + 2:]
+    elif ':' in host:
+        host, _, port = host.partition(':')
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix) and host.count('.') > 1:
+            host = host[len(prefix):]
+            break
+    return host, port
+
+
+def rule_for(host):
+    # Exact host first, then each parent domain: a.b.tasty.co -> b.tasty.co -> tasty.co
+    while host:
+        rule = HOST_RULES.get(host)
+        if rule is not None:
+            return rule
+        host = host.partition('.')[2]
+    return DEFAULT_RULE
+
+
+@lru_cache(maxsize=16384)
+def canonicalize(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in ('http', 'https'):
+        return url.strip()
+
+    host, port = canonical_host(parts.netloc)
+    if port == DEFAULT_PORTS[scheme]:
+        port = ''
+    netloc = f'{host}:{port}' if port else host
+
+    path = DUPLICATE_SLASHES.sub('/', parts.path)
+    if len(path) > 1 and path.endswith('/'):
+        path = path.rstrip('/')
+    path = path or '/'
+
+    query = ''
+    if parts.query:
+        keep = rule_for(host)['query']
+        params = []
+        for pair in parts.query.split('&'):
+            if not pair:
+                continue
+            name = pair.partition('=')[0]
+            if keep is None:
+                if not is_tracking_param(name):
+                    params.append(pair)
+            elif name in keep:
+                params.append(pair)
+        params.sort()
+        query = '&'.join(params)
+
+    # Recipe sites serve the same page over http and https; key on https.
+    return urlunsplit(('https', netloc, path, query, ''))
+
+
+def find_canonical_link(html, base_url, limit=262144):
+    # <link rel="canonical"> lives in <head>, so only the start of the page is
+    # scanned.
+    match = CANONICAL_LINK.search(html, 0, limit)
+    if match is None:
+        return None
+    href = HREF.search(match.group(0))
+    if href is None:
+        return None
+    value = next(group for group in href.groups() if group is not None).strip()
+    if not value:
+        return None
+    try:
+        return urljoin(base_url, value)
+    except ValueError:
+        return None
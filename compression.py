@@ -0,0 +1,107 @@
+import gzip
+import hashlib
+import os
+import zlib
+
+from dotenv import load_dotenv
+
+from recipe_cache import RecipeCache, RECIPE_CACHE_TTL
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+load_dotenv()
+
+# Bodies smaller than this go out uncompressed: below about a kilobyte the
+# headers and CPU cost outweigh the saving.
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 5))
+# Compressed copies of recipe payloads, so a hot recipe is compressed once
+# per encoding rather than on every hit.
+COMPRESS_CACHE_MAX_BYTES = int(os.getenv('COMPRESS_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+# In order of preference when the client accepts both equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+compressed_cache = RecipeCache(max_bytes=COMPRESS_CACHE_MAX_BYTES, ttl=RECIPE_CACHE_TTL, stale_ttl=0)
+
+
+def negotiate(accept_encoding):
+    # The best encoding the client accepts per its Accept-Encoding q-values,
+    # or None for identity
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+def body_digest(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def choose_encoding(body, accept_encoding):
+    if len(body) < COMPRESS_MIN_BYTES:
+        return None
+    return negotiate(accept_encoding)
+
+
+def encode_body(body, encoding, digest=None):
+    # The body in `encoding` (None for identity). Given the body's digest,
+    # the compressed form is kept by content hash and reused by every later
+    # request for the same payload.
+    if encoding is None:
+        return body
+    if digest is None:
+        return compress(body, encoding)
+    key = f'{encoding}:{digest}'
+    cached = compressed_cache.lookup(key)
+    if cached is not None:
+        return cached[0]
+    compressed = compress(body, encoding)
+    compressed_cache.set(key, compressed)
+    return compressed
+
+
+def compress_stream(chunks, encoding):
+    # Compresses a streamed response chunk by chunk, flushing after each so
+    # the client can decode every line as soon as it arrives.
+    try:
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+            for chunk in chunks:
+                yield compressor.process(chunk) + compressor.flush()
+            yield compressor.finish()
+        else:
+            compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+            for chunk in chunks:
+                yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield compressor.flush()
+    finally:
+        # Runs the wrapped generator's own cleanup when the client goes away
+        chunks.close()
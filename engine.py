@@ -0,0 +1,148 @@
+import asyncio
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Threads used for blocking I/O that has no async client (Selenium, or plain
+# requests when aiohttp is not installed).
+IO_WORKERS = int(os.getenv('ENGINE_IO_WORKERS', 64))
+# CPU-bound HTML/JSON parsing runs off the event loop. A process pool sidesteps
+# the GIL at the cost of pickling the page text across.
+PARSE_EXECUTOR = os.getenv('ENGINE_PARSE_EXECUTOR', 'thread').lower()
+PARSE_WORKERS = int(os.getenv('ENGINE_PARSE_WORKERS', os.cpu_count() or 4))
+
+_loop = None
+_loop_lock = threading.Lock()
+_io_executor = None
+_parse_executor = None
+
+
+def _run_loop(loop, ready):
+    asyncio.set_event_loop(loop)
+    loop.call_soon(ready.set)
+    loop.run_forever()
+
+
+def get_loop():
+    # One long-lived event loop per process, running in a daemon thread. Flask
+    # worker threads and the ASGI adapter both submit coroutines to it, so
+    # async client sessions and their connection pools are shared.
+    global _loop, _io_executor, _parse_executor
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                _io_executor = ThreadPoolExecutor(IO_WORKERS, thread_name_prefix='engine-io')
+                if PARSE_EXECUTOR == 'process':
+                    _parse_executor = ProcessPoolExecutor(PARSE_WORKERS)
+                else:
+                    _parse_executor = ThreadPoolExecutor(PARSE_WORKERS, thread_name_prefix='engine-parse')
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(_io_executor)
+                ready = threading.Event()
+                threading.Thread(target=_run_loop, args=(loop, ready), name='engine-loop', daemon=True).start()
+                ready.wait()
+                _loop = loop
+    return _loop
+
+
+def submit(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro, timeout=None):
+    return submit(coro).result(timeout)
+
+
+async def run_async(coro):
+    # Await a coroutine on the engine loop from a different event loop (e.g.
+    # the ASGI server's) without blocking it.
+    loop = get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+async def run_blocking(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_io_executor, fn, *args)
+
+
+async def run_cpu(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_parse_executor, fn, *args)
+
+
+class SingleFlight:
+    # Collapses concurrent calls for the same key onto one execution; every
+    # caller gets its result (or exception). The execution is cancelled once
+    # every caller waiting on it has been cancelled. Only used from the
+    # engine loop.
+    def __init__(self):
+        self._calls = {}
+        self.executions = 0
+        self.collapsed = 0
+        self.abandoned = 0
+
+    async def do(self, key, factory):
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(factory())
+            call = self._calls[key] = [task, 0]
+            self.executions += 1
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.collapsed += 1
+        task = call[0]
+        call[1] += 1
+        try:
+            # One caller going away (e.g. a dropped stream) must not cancel
+            # the work the others are still waiting on
+            return await asyncio.shield(task)
+        finally:
+            call[1] -= 1
+            if not call[1] and not task.done():
+                # Nobody is left to read the result. Forget the call now so a
+                # new caller starts afresh instead of joining the cancelled one.
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                self.abandoned += 1
+                task.cancel()
+
+    def _forget(self, key, task):
+        call = self._calls.get(key)
+        if call is not None and call[0] is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every waiter went away
+
+    def stats(self):
+        calls = self.executions + self.collapsed
+        return {
+            "in_flight": len(self._calls),
+            "executions": self.executions,
+            "collapsed": self.collapsed,
+            "abandoned": self.abandoned,
+            "collapse_ratio": round(self.collapsed / calls, 4) if calls else 0.0,
+        }
+
+
+def shutdown():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            return
+        _loop.call_soon_threadsafe(_loop.stop)
+        _io_executor.shutdown(wait=False)
+        _parse_executor.shutdown(wait=False)
+        _loop = None
+
+
+atexit.register(shutdown)
@@ -0,0 +1,79 @@
+import collections
+from urllib.parse import urlsplit
+
+from canonical_url import canonical_host
+
+
+RENDERERS = ('static', 'auto', 'browser')
+
+
+class Extractor:
+    # Extraction policy for one site. Subclasses implement extract() and
+    # override whichever settings differ from the defaults; None means "use
+    # the process-wide setting".
+    name = 'default'
+    renderer = 'static'   # 'static', 'auto' (static first, browser when the JSON-LD is missing) or 'browser'
+    concurrency = None    # scrapes in flight for the site within a batch
+    cache_ttl = None      # seconds a result stays fresh in the cache and store
+    timeout = None        # (connect, read) seconds for the page fetch
+
+    def __init__(self):
+        # Calls and total seconds per pipeline stage
+        self.stages = collections.Counter()
+
+    async def extract(self, url):
+        raise NotImplementedError
+
+    def record(self, stage, seconds):
+        self.stages[stage] += 1
+        self.stages[f'{stage}_seconds'] += seconds
+
+    def settings(self):
+        return {
+            "renderer": self.renderer,
+            "concurrency": self.concurrency,
+            "cache_ttl": self.cache_ttl,
+            "timeout": self.timeout,
+            "stages": {name: round(value, 3) for name, value in self.stages.items()},
+        }
+
+
+class ExtractorRegistry:
+    # Maps hosts to extractors. An exact host wins, then the nearest
+    # registered parent domain: a.b.tasty.co finds tasty.co but
+    # nottasty.co.uk does not. Each step is one dict lookup.
+    def __init__(self, default):
+        self.default = default
+        self._hosts = {}
+        self._domains = {}
+
+    def register(self, extractor, hosts=(), domains=()):
+        # `hosts` match exactly, `domains` also match every subdomain. Both
+        # are compared in canonical form, without a leading www.
+        if extractor.renderer not in RENDERERS:
+            raise ValueError(f'unknown renderer {extractor.renderer!r} for {extractor.name}')
+        for host in hosts:
+            self._hosts[canonical_host(host)[0]] = extractor
+        for domain in domains:
+            self._domains[canonical_host(domain)[0]] = extractor
+        return extractor
+
+    def lookup(self, url):
+        host = canonical_host(urlsplit(url).netloc)[0]
+        extractor = self._hosts.get(host)
+        if extractor is not None:
+            return extractor
+        while host:
+            extractor = self._domains.get(host)
+            if extractor is not None:
+                return extractor
+            host = host.partition('.')[2]
+        return self.default
+
+    def snapshot(self):
+        extractors = {self.default.name: dict(self.default.settings(), hosts=[], domains=[])}
+        for field, table in (("hosts", self._hosts), ("domains", self._domains)):
+            for host, extractor in table.items():
+                entry = extractors.setdefault(extractor.name, dict(extractor.settings(), hosts=[], domains=[]))
+                entry[field].append(host)
+        return extractors
@@ -0,0 +1,194 @@
+import asyncio
+import email.utils
+import os
+import time
+
+from dotenv import load_dotenv
+
+from canonical_url import canonical_host
+
+
+load_dotenv()
+
+# Sustained requests per second and burst size allowed per host, and the
+# number of requests to one host allowed in flight at once.
+HOST_RATE = float(os.getenv('HOST_RATE', 5))
+HOST_BURST = float(os.getenv('HOST_BURST', 10))
+HOST_CONNECTIONS = int(os.getenv('HOST_CONNECTIONS', 4))
+# Per-host rate overrides, e.g. "resepichenom.com=2,tasty.co=10"
+HOST_RATES = os.getenv('HOST_RATES', '')
+# A host answering 429/503 has its rate halved down to HOST_MIN_RATE and is
+# paused for its Retry-After, or for an exponential backoff capped at
+# HOST_MAX_BACKOFF seconds when it sends none. HOST_MAX_RETRY_AFTER bounds
+# the pause a host may ask for itself.
+HOST_MIN_RATE = float(os.getenv('HOST_MIN_RATE', 0.2))
+HOST_MAX_BACKOFF = float(os.getenv('HOST_MAX_BACKOFF', 60))
+HOST_MAX_RETRY_AFTER = float(os.getenv('HOST_MAX_RETRY_AFTER', 60 * 60))
+
+THROTTLED = (429, 503)
+
+
+def parse_rates(value):
+    rates = {}
+    for item in value.split(','):
+        host, _, rate = item.partition('=')
+        if host.strip() and rate.strip():
+            rates[canonical_host(host.strip())[0]] = float(rate)
+    return rates
+
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class HostState:
+    __slots__ = ('rate', 'max_rate', 'tokens', 'updated', 'paused_until', 'strikes', 'slots', 'users')
+
+    def __init__(self, rate, burst, connections, now):
+        self.rate = rate
+        self.max_rate = rate
+        self.tokens = burst
+        self.updated = now
+        self.paused_until = 0.0
+        self.strikes = 0
+        self.slots = asyncio.Semaphore(connections)
+        self.users = 0
+
+
+class HostScheduler:
+    # Paces outbound fetches per host: a token bucket sets the request rate, a
+    # semaphore caps concurrent requests, and 429/503 answers pause the host
+    # and cut its rate, which then recovers step by step on successful
+    # responses. Hosts are independent, so a throttled site never holds back
+    # the others. acquire() and release() run on the engine loop.
+    PRUNE_EVERY = 1000
+
+    def __init__(self, rate=HOST_RATE, burst=HOST_BURST, connections=HOST_CONNECTIONS,
+                 min_rate=HOST_MIN_RATE, max_backoff=HOST_MAX_BACKOFF, max_retry_after=HOST_MAX_RETRY_AFTER,
+                 rates=None):
+        self.rate = rate
+        self.burst = burst
+        self.connections = connections
+        self.min_rate = min_rate
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.rates = parse_rates(HOST_RATES) if rates is None else rates
+        self._hosts = {}
+        self.requests = 0
+        self.throttled = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _state(self, host, now):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = HostState(self.rates.get(host, self.rate), self.burst, self.connections, now)
+        return state
+
+    async def acquire(self, host):
+        # Waits for a connection slot, the end of any pause and a token.
+        # Returns the key to hand back to release().
+        host = canonical_host(host)[0]
+        started = time.monotonic()
+        state = self._state(host, started)
+        state.users += 1
+        try:
+            await state.slots.acquire()
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = state.paused_until - now
+                    if wait <= 0:
+                        state.tokens = min(self.burst, state.tokens + (now - state.updated) * state.rate)
+                        state.updated = now
+                        if state.tokens >= 1:
+                            state.tokens -= 1
+                            break
+                        wait = (1 - state.tokens) / state.rate
+                    await asyncio.sleep(wait)
+            except BaseException:
+                state.slots.release()
+                raise
+        except BaseException:
+            state.users -= 1
+            raise
+        now = time.monotonic()
+        if now - started > 0.001:
+            self.waits += 1
+            self.wait_seconds += now - started
+        self.requests += 1
+        if self.requests % self.PRUNE_EVERY == 0:
+            self._prune(now)
+        return host
+
+    def release(self, host, status=None, retry_after=None):
+        # `host` as returned by acquire(); `status` is None when the request
+        # failed without a response
+        state = self._hosts[host]
+        state.slots.release()
+        state.users -= 1
+        if status in THROTTLED:
+            self.throttled += 1
+            state.strikes += 1
+            state.rate = max(self.min_rate, state.rate / 2)
+            delay = parse_retry_after(retry_after)
+            if delay is None:
+                delay = min(2 ** (state.strikes - 1) / state.rate, self.max_backoff)
+            else:
+                delay = min(delay, self.max_retry_after)
+            now = time.monotonic()
+            state.paused_until = max(state.paused_until, now + delay)
+            # The bucket starts refilling only once the pause is over
+            state.tokens = 0
+            state.updated = state.paused_until
+        elif status is not None:
+            state.strikes = 0
+            if state.rate < state.max_rate:
+                state.rate = min(state.max_rate, state.rate + state.max_rate / 10)
+
+    def paused_for(self, host):
+        # Seconds until a host paused by a 429/503 takes requests again
+        state = self._hosts.get(canonical_host(host)[0])
+        if state is None:
+            return 0.0
+        return max(0.0, state.paused_until - time.monotonic())
+
+    def _prune(self, now):
+        # Forget hosts nobody is using whose bucket has refilled and that are
+        # back at full rate; they are recreated as new on their next request
+        for host, state in list(self._hosts.items()):
+            if (not state.users and state.rate == state.max_rate and state.paused_until <= now
+                    and state.tokens + (now - state.updated) * state.rate >= self.burst):
+                del self._hosts[host]
+
+    def stats(self):
+        now = time.monotonic()
+        backing_off = {}
+        for host, state in list(self._hosts.items()):
+            if state.rate < state.max_rate or state.paused_until > now:
+                backing_off[host] = {
+                    "rate": round(state.rate, 3),
+                    "paused_for": round(max(0.0, state.paused_until - now), 1),
+                    "strikes": state.strikes,
+                }
+        return {
+            "hosts": len(self._hosts),
+            "rate": self.rate,
+            "burst": self.burst,
+            "connections": self.connections,
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "backing_off": backing_off,
+        }
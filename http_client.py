@@ -0,0 +1,421 @@
+import asyncio
+import codecs
+import collections
+import contextvars
+import os
+import random
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+import engine
+from host_scheduler import HostScheduler
+from jsonld import LdJsonScanner
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+load_dotenv()
+
+# Number of distinct hosts to keep a connection pool for, and the number of
+# keep-alive connections kept open per host.
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 16))
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 32))
+HTTP_POOL_BLOCK = os.getenv('HTTP_POOL_BLOCK', 'false').lower() in ('1', 'true', 'yes')
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 20))
+# Upper bound on open connections held by the async client across all hosts.
+HTTP_ASYNC_MAX_CONNECTIONS = int(os.getenv('HTTP_ASYNC_MAX_CONNECTIONS', 512))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', 30))
+# Streamed page reads stop as soon as a complete Recipe JSON-LD block has
+# arrived, and never read more than HTTP_MAX_PAGE_BYTES of any page.
+HTTP_STREAM_PAGES = os.getenv('HTTP_STREAM_PAGES', 'true').lower() in ('1', 'true', 'yes')
+HTTP_MAX_PAGE_BYTES = int(os.getenv('HTTP_MAX_PAGE_BYTES', 5 * 1024 * 1024))
+HTTP_CHUNK_SIZE = int(os.getenv('HTTP_CHUNK_SIZE', 16 * 1024))
+# After an early stop, a remainder up to this size is still read so the
+# connection can go back to the pool; a larger one is cut off, dropping the
+# connection. 0 always cuts off.
+HTTP_DRAIN_BYTES = int(os.getenv('HTTP_DRAIN_BYTES', 256 * 1024))
+# Page fetches are retried on connection errors, timeouts and retryable
+# statuses, up to HTTP_RETRIES times with jittered exponential backoff.
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 2))
+HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', 0.25))
+HTTP_RETRY_BACKOFF_MAX = float(os.getenv('HTTP_RETRY_BACKOFF_MAX', 5))
+# Retries across the process may add at most this fraction of the requests
+# made in the last HTTP_RETRY_BUDGET_WINDOW seconds, plus
+# HTTP_RETRY_BUDGET_MIN per second so a quiet process can still retry.
+HTTP_RETRY_BUDGET = float(os.getenv('HTTP_RETRY_BUDGET', 0.1))
+HTTP_RETRY_BUDGET_WINDOW = int(os.getenv('HTTP_RETRY_BUDGET_WINDOW', 10))
+HTTP_RETRY_BUDGET_MIN = float(os.getenv('HTTP_RETRY_BUDGET_MIN', 1))
+# A retry is given up when the host scheduler has the host paused for longer
+# than this, e.g. on a 503 with a long Retry-After.
+HTTP_RETRY_MAX_WAIT = float(os.getenv('HTTP_RETRY_MAX_WAIT', 5))
+# 429 is left out: the host asked us to slow down, and the scheduler already
+# does that for later requests.
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
+
+CHARSET = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+
+_session = None
+_session_lock = threading.Lock()
+_async_sessions = {}
+fetch_stats = collections.Counter()
+_stats_lock = threading.Lock()
+# Paces every page fetch per host
+host_scheduler = HostScheduler()
+
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+if aiohttp is not None:
+    RETRY_ERRORS += (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)
+
+
+def count(name, amount=1):
+    with _stats_lock:
+        fetch_stats[name] += amount
+
+
+class NotModified(Exception):
+    def __init__(self, url):
+        super().__init__(f'{url} not modified')
+        self.url = url
+
+
+class Revalidation:
+    # Validators for one page load. The stored ETag/Last-Modified are sent as
+    # conditional headers when `url` is fetched, and the validators of the
+    # fresh response are recorded for the caller to persist.
+    def __init__(self, url, etag=None, last_modified=None):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.response_etag = None
+        self.response_last_modified = None
+
+    def request_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def record(self, headers):
+        self.response_etag = headers.get('ETag')
+        self.response_last_modified = headers.get('Last-Modified')
+
+
+revalidation = contextvars.ContextVar('revalidation', default=None)
+
+
+class RetryBudget:
+    # Caps retries to a share of recent traffic, so an upstream outage can't
+    # multiply outbound load: counts are kept in one-second buckets over a
+    # sliding window.
+    def __init__(self, ratio=HTTP_RETRY_BUDGET, window=HTTP_RETRY_BUDGET_WINDOW, min_per_second=HTTP_RETRY_BUDGET_MIN):
+        self.ratio = ratio
+        self.window = window
+        self.min_per_second = min_per_second
+        self._requests = collections.deque()
+        self._retries = collections.deque()
+        self._lock = threading.Lock()
+        self.granted = 0
+        self.denied = 0
+
+    def _add(self, buckets, now):
+        second = int(now)
+        if buckets and buckets[-1][0] == second:
+            buckets[-1][1] += 1
+        else:
+            buckets.append([second, 1])
+
+    def _total(self, buckets, now):
+        while buckets and buckets[0][0] <= now - self.window:
+            buckets.popleft()
+        return sum(count for _, count in buckets)
+
+    def request(self):
+        with self._lock:
+            self._add(self._requests, time.monotonic())
+
+    def try_retry(self):
+        now = time.monotonic()
+        with self._lock:
+            allowed = self._total(self._requests, now) * self.ratio + self.min_per_second * self.window
+            if self._total(self._retries, now) >= allowed:
+                self.denied += 1
+                return False
+            self._add(self._retries, now)
+            self.granted += 1
+            return True
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "ratio": self.ratio,
+                "window": self.window,
+                "requests": self._total(self._requests, now),
+                "retries": self._total(self._retries, now),
+                "granted": self.granted,
+                "denied": self.denied,
+            }
+
+
+retry_budget = RetryBudget()
+
+
+class Page:
+    def __init__(self, url, status_code, headers, text):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+
+
+def response_encoding(headers):
+    match = CHARSET.search(headers.get('Content-Type', ''))
+    if match:
+        try:
+            return codecs.lookup(match.group(1)).name
+        except LookupError:
+            pass
+    return 'utf-8'
+
+
+class PageReader:
+    # Decodes a body chunk by chunk and reports when reading can stop: once
+    # the scanner has a full Recipe JSON-LD block or the byte cap is reached.
+    def __init__(self, encoding, max_bytes=HTTP_MAX_PAGE_BYTES):
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self.scanner = LdJsonScanner()
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+
+    def feed(self, chunk):
+        self.bytes_read += len(chunk)
+        if self.scanner.feed(self.decoder.decode(chunk)):
+            count('early_terminations')
+            return True
+        if self.bytes_read >= self.max_bytes:
+            count('byte_cap_hits')
+            return True
+        return False
+
+    def should_drain(self, headers):
+        # Worth reading the rest of the body to keep the connection? Not
+        # after a byte cap hit, nor when Content-Length shows too much is
+        # left. For a compressed body Content-Length is smaller than what
+        # has been decoded, so this errs toward trying; the drain stays
+        # capped either way.
+        if not self.scanner.found or HTTP_DRAIN_BYTES <= 0:
+            return False
+        length = headers.get('Content-Length', '')
+        return not length.isdigit() or int(length) - self.bytes_read <= HTTP_DRAIN_BYTES
+
+    def finish(self):
+        self.scanner.feed(self.decoder.decode(b'', final=True))
+        count('bytes_read', self.bytes_read)
+        return self.scanner.text
+
+
+def create_session(pool_connections=None, pool_maxsize=None, pool_block=None):
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections or HTTP_POOL_CONNECTIONS,
+        pool_maxsize=pool_maxsize or HTTP_POOL_MAXSIZE,
+        pool_block=HTTP_POOL_BLOCK if pool_block is None else pool_block)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+    return session
+
+
+def get_session():
+    # requests.Session is safe to share between threads for plain GETs: the
+    # underlying urllib3 PoolManager hands out one connection per request and
+    # returns it to the per-host pool afterwards.
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def default_timeout():
+    return (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+
+def http_get(url, **kwargs):
+    kwargs.setdefault('timeout', default_timeout())
+    return get_session().get(url, **kwargs)
+
+
+def _fetch_page(url, headers=None, timeout=None):
+    timeout = timeout or default_timeout()
+    if not HTTP_STREAM_PAGES:
+        response = http_get(url, headers=headers, timeout=timeout)
+        return Page(response.url, response.status_code, response.headers, response.text)
+
+    response = http_get(url, headers=headers, stream=True, timeout=timeout)
+    try:
+        reader = PageReader(response_encoding(response.headers))
+        chunks = response.iter_content(HTTP_CHUNK_SIZE)
+        for chunk in chunks:
+            if reader.feed(chunk):
+                if reader.should_drain(response.headers):
+                    _drain(chunks)
+                break
+        text = reader.finish()
+    finally:
+        # A body read to the end hands the connection back to the pool; one
+        # cut off early drops it.
+        response.close()
+    return Page(response.url, response.status_code, response.headers, text)
+
+
+async def _fetch_page_aiohttp(url, headers=None, timeout=None):
+    options = {}
+    if timeout is not None:
+        # Passing timeout=None would disable the session's timeouts entirely
+        options['timeout'] = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+    async with _get_async_session().get(url, headers=headers, **options) as response:
+        if not HTTP_STREAM_PAGES:
+            text = await response.text(errors='replace')
+            return Page(str(response.url), response.status, response.headers, text)
+
+        reader = PageReader(response_encoding(response.headers))
+        async for chunk in response.content.iter_chunked(HTTP_CHUNK_SIZE):
+            if reader.feed(chunk):
+                if not (reader.should_drain(response.headers)
+                        and await _drain_async(response.content)):
+                    response.close()
+                break
+        text = reader.finish()
+        return Page(str(response.url), response.status, response.headers, text)
+
+
+def _drain(chunks):
+    # Reads the rest of a body, giving up past HTTP_DRAIN_BYTES. True when
+    # the body ended in time.
+    drained = 0
+    for chunk in chunks:
+        drained += len(chunk)
+        if drained > HTTP_DRAIN_BYTES:
+            count('drain_cutoffs')
+            return False
+    count('drained')
+    count('bytes_drained', drained)
+    return True
+
+
+async def _drain_async(content):
+    drained = 0
+    async for chunk in content.iter_chunked(HTTP_CHUNK_SIZE):
+        drained += len(chunk)
+        if drained > HTTP_DRAIN_BYTES:
+            count('drain_cutoffs')
+            return False
+    count('drained')
+    count('bytes_drained', drained)
+    return True
+
+
+def _get_async_session():
+    # aiohttp sessions are bound to the loop they were created on; in practice
+    # that is only ever the engine loop.
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_ASYNC_MAX_CONNECTIONS,
+            limit_per_host=HTTP_POOL_MAXSIZE,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT)
+        timeout = aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+        session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        _async_sessions[loop] = session
+    return session
+
+
+def retry_delay(attempt):
+    # "Full jitter": a random wait up to the exponential bound, so clients
+    # that failed together don't retry in lockstep
+    return random.uniform(0, min(HTTP_RETRY_BACKOFF_MAX, HTTP_RETRY_BACKOFF * 2 ** (attempt - 1)))
+
+
+def _may_retry(attempt, host):
+    if attempt >= HTTP_RETRIES:
+        return False
+    if host_scheduler.paused_for(host) > HTTP_RETRY_MAX_WAIT:
+        count('retries_paused')
+        return False
+    if not retry_budget.try_retry():
+        count('retries_denied')
+        return False
+    return True
+
+
+async def _fetch_page_paced(url, headers=None, timeout=None):
+    host = await host_scheduler.acquire(urlsplit(url).netloc)
+    page = None
+    try:
+        if aiohttp is None:
+            page = await engine.run_blocking(_fetch_page, url, headers, timeout)
+        else:
+            page = await _fetch_page_aiohttp(url, headers, timeout)
+    finally:
+        if page is None:
+            host_scheduler.release(host)
+        else:
+            host_scheduler.release(host, page.status_code, page.headers.get('Retry-After'))
+    return page
+
+
+async def fetch_page_async(url, timeout=None):
+    # `timeout` is a (connect, read) pair overriding the client default
+    conditional = revalidation.get()
+    if conditional is not None and conditional.url != url:
+        conditional = None
+    headers = conditional.request_headers() if conditional is not None else None
+    if headers:
+        count('conditional_requests')
+
+    retry_budget.request()
+    host = urlsplit(url).netloc
+    attempt = 0
+    while True:
+        try:
+            page = await _fetch_page_paced(url, headers, timeout)
+        except RETRY_ERRORS:
+            if not _may_retry(attempt, host):
+                raise
+        else:
+            if page.status_code not in RETRY_STATUSES or not _may_retry(attempt, host):
+                break
+        attempt += 1
+        count('retries')
+        await asyncio.sleep(retry_delay(attempt))
+    count('pages')
+
+    if conditional is not None:
+        if headers and page.status_code == 304:
+            count('not_modified')
+            raise NotModified(url)
+        conditional.record(page.headers)
+    return page
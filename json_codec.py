@@ -0,0 +1,90 @@
+import json
+import os
+
+from dotenv import load_dotenv
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+load_dotenv()
+
+# Which library decodes ld+json and encodes responses: 'orjson', 'json' (the
+# standard library), or 'auto' for orjson when it is installed.
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto').lower()
+
+
+# strict=False accepts the raw newlines and tabs sites leave inside JSON-LD
+# strings, so the text never has to be copied to strip them. One shared
+# decoder: json.loads() builds a new one whenever it is given options.
+lenient_decoder = json.JSONDecoder(strict=False)
+
+
+def stdlib_loads(text):
+    if isinstance(text, (bytes, bytearray)):
+        text = text.decode('utf-8')
+    return lenient_decoder.decode(text)
+
+
+def stdlib_dumpb(obj, pretty=False, sort_keys=False):
+    if pretty:
+        text = json.dumps(obj, ensure_ascii=False, indent=2, sort_keys=sort_keys)
+    else:
+        text = json.dumps(obj, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys)
+    return text.encode('utf-8')
+
+
+def orjson_loads(text):
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        # orjson has no lenient mode for raw control characters in strings;
+        # the rare page that needs one goes through the standard library
+        return stdlib_loads(text)
+
+
+def orjson_dumpb(obj, pretty=False, sort_keys=False):
+    option = (orjson.OPT_INDENT_2 if pretty else 0) | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+    try:
+        return orjson.dumps(obj, option=option)
+    except TypeError:
+        # e.g. integers wider than 64 bits
+        return stdlib_dumpb(obj, pretty, sort_keys)
+
+
+BACKENDS = {'json': (stdlib_loads, stdlib_dumpb)}
+if orjson is not None:
+    BACKENDS['orjson'] = (orjson_loads, orjson_dumpb)
+
+
+def resolve_backend(name):
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in BACKENDS else 'json'
+    if name not in BACKENDS:
+        print(f'JSON backend {name!r} is not available, falling back to json')
+        name = 'json'
+    return name
+
+
+backend = resolve_backend(JSON_BACKEND)
+
+
+def set_backend(name):
+    global backend
+    backend = resolve_backend(name)
+    return backend
+
+
+def loads(text):
+    return BACKENDS[backend][0](text)
+
+
+def dumpb(obj, pretty=False, sort_keys=False):
+    # UTF-8 bytes, ready to send or store without another encoding pass
+    return BACKENDS[backend][1](obj, pretty, sort_keys)
+
+
+def dumps(obj, pretty=False, sort_keys=False):
+    return dumpb(obj, pretty, sort_keys).decode('utf-8')
@@ -0,0 +1,217 @@
+import os
+import re
+
+from bs4 import BeautifulSoup, SoupStrainer
+from dotenv import load_dotenv
+
+import json_codec
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser as SelectolaxParser
+    except ImportError:
+        SelectolaxParser = None
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+
+load_dotenv()
+
+# Which backend locates JSON-LD blocks: 'scan' (regex scanner, no DOM),
+# 'selectolax', 'lxml', 'html.parser', or 'auto' for the fastest real HTML
+# parser that is installed.
+HTML_PARSER = os.getenv('HTML_PARSER', 'scan').lower()
+
+# Matches the opening tag of a JSON-LD script, whatever its attribute order
+# or quoting: <script type="application/ld+json">, <script id=x type=application/ld+json>
+LD_JSON_OPEN = re.compile(
+    r'<script\b[^>]*?\btype\s*=\s*(["\']?)application/ld\+json\1[^>]*>', re.IGNORECASE)
+SCRIPT_CLOSE = re.compile(r'</script\s*>', re.IGNORECASE)
+RECIPE_TYPE = re.compile(r'"@type"\s*:\s*(\[[^\]]*)?"Recipe"')
+LD_JSON_SELECTOR = 'script[type="application/ld+json"]'
+
+
+def iter_ld_json(html):
+    # Yields the raw text of every <script type="application/ld+json"> block
+    # without building a DOM: a regex finds each opening tag and the block
+    # runs to the next </script>, exactly as an HTML parser treats script
+    # content.
+    pos = 0
+    while True:
+        start = LD_JSON_OPEN.search(html, pos)
+        if start is None:
+            return
+        end = SCRIPT_CLOSE.search(html, start.end())
+        if end is None:
+            return
+        yield html[start.end():end.start()]
+        pos = end.end()
+
+
+class LdJsonScanner:
+    # Incremental version of iter_ld_json for pages arriving in chunks.
+    # feed() returns True once a complete JSON-LD block declaring a Recipe
+    # has been received, so the caller can stop downloading. Each chunk is
+    # searched once, together with a short overlap from the previous one, and
+    # the page text is only joined when `text` is read.
+    OVERLAP = 256  # longest opening tag we expect to straddle two chunks
+    CLOSE_OVERLAP = 32  # the same for a closing </script>
+
+    def __init__(self):
+        self._chunks = []
+        self._tail = ''  # end of the text already searched, still in play
+        self._block = None  # content so far of a block whose close has not arrived
+        self.found = False
+
+    @property
+    def text(self):
+        if len(self._chunks) > 1:
+            self._chunks = [''.join(self._chunks)]
+        return self._chunks[0] if self._chunks else ''
+
+    def feed(self, chunk):
+        self._chunks.append(chunk)
+        if self.found:
+            return True
+        text = self._tail + chunk
+        while True:
+            if self._block is None:
+                start = LD_JSON_OPEN.search(text)
+                if start is None:
+                    self._tail = text[-self.OVERLAP:]
+                    return False
+                self._block = []
+                text = text[start.end():]
+            end = SCRIPT_CLOSE.search(text)
+            if end is None:
+                self._block.append(text[:-self.CLOSE_OVERLAP])
+                self._tail = text[-self.CLOSE_OVERLAP:]
+                return False
+            self._block.append(text[:end.start()])
+            block = ''.join(self._block)
+            self._block = None
+            if RECIPE_TYPE.search(block):
+                self.found = True
+                return True
+            text = text[end.end():]
+
+
+def scan_ld_json(html):
+    return list(iter_ld_json(html))
+
+
+def selectolax_ld_json(html):
+    return [node.text(deep=True) for node in SelectolaxParser(html).css(LD_JSON_SELECTOR)]
+
+
+def lxml_ld_json(html):
+    parser = lxml.html.HTMLParser(encoding='utf-8')
+    document = lxml.html.document_fromstring(html.encode('utf-8'), parser=parser)
+    return [node.text or '' for node in document.xpath('//script[@type="application/ld+json"]')]
+
+
+def html_parser_ld_json(html):
+    only_ld_json = SoupStrainer('script', type='application/ld+json')
+    soup = BeautifulSoup(html, 'html.parser', parse_only=only_ld_json)
+    return [script.string or '' for script in soup.find_all('script')]
+
+
+BACKENDS = {'scan': scan_ld_json, 'html.parser': html_parser_ld_json}
+if SelectolaxParser is not None:
+    BACKENDS['selectolax'] = selectolax_ld_json
+if lxml is not None:
+    BACKENDS['lxml'] = lxml_ld_json
+
+
+def resolve_backend(name):
+    if name == 'auto':
+        name = next(backend for backend in ('selectolax', 'lxml', 'html.parser') if backend in BACKENDS)
+    if name not in BACKENDS:
+        print(f'HTML parser backend {name!r} is not available, falling back to html.parser')
+        name = 'html.parser'
+    return name
+
+
+backend = resolve_backend(HTML_PARSER)
+
+
+def set_backend(name):
+    global backend
+    backend = resolve_backend(name)
+    return backend
+
+
+def extract_ld_json(html):
+    return BACKENDS[backend](html)
+
+
+def type_names(node):
+    # '@type' may be a string or a list, and may be written as a compact IRI
+    # or a full one: "Recipe", ["Recipe", "NewsArticle"], "schema:Recipe",
+    # "http://schema.org/Recipe".
+    types = node.get('@type')
+    if isinstance(types, str):
+        types = [types]
+    elif not isinstance(types, list):
+        return []
+    return [name.rpartition('/')[2].rpartition(':')[2] for name in types if isinstance(name, str)]
+
+
+class JsonLdIndex:
+    # Every node from every JSON-LD block on a page, indexed by type and @id.
+    # Top-level lists, @graph documents (nested or not) and a page's
+    # mainEntity are all walked once, so lookups don't care which block, or
+    # how deep in it, a site put its Recipe.
+    def __init__(self):
+        self.by_type = {}
+        self.by_id = {}
+        self.errors = []
+
+    def add_block(self, text):
+        try:
+            data = json_codec.loads(text)
+        except ValueError as e:
+            self.errors.append(e)
+            return
+        self.add(data)
+
+    def add(self, data):
+        if isinstance(data, list):
+            for item in data:
+                self.add(item)
+            return
+        if not isinstance(data, dict):
+            return
+        for name in type_names(data):
+            self.by_type.setdefault(name, []).append(data)
+        node_id = data.get('@id')
+        if isinstance(node_id, str) and (node_id not in self.by_id or len(data) > len(self.by_id[node_id])):
+            # Keep the full node rather than a bare {"@id": ...} reference to it
+            self.by_id[node_id] = data
+        for key in ('@graph', 'mainEntity'):
+            if isinstance(data.get(key), (dict, list)):
+                self.add(data[key])
+
+    def first(self, type_name):
+        nodes = self.by_type.get(type_name)
+        return nodes[0] if nodes else None
+
+    def resolve(self, value):
+        # Follows {"@id": ...} references to the node they point at
+        if isinstance(value, list):
+            return [self.resolve(item) for item in value]
+        if isinstance(value, dict) and set(value) == {'@id'}:
+            return self.by_id.get(value['@id'], value)
+        return value
+
+
+def index_ld_json(html):
+    index = JsonLdIndex()
+    for block in extract_ld_json(html):
+        index.add_block(block)
+    return index
@@ -0,0 +1,243 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+RECIPE_CACHE_MAX_BYTES = int(os.getenv('RECIPE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+RECIPE_CACHE_TTL = float(os.getenv('RECIPE_CACHE_TTL', 6 * 60 * 60))
+# Shared on-disk store; set RECIPE_STORE_PATH to an empty string to disable.
+RECIPE_STORE_PATH = os.getenv('RECIPE_STORE_PATH', 'recipes.db')
+RECIPE_STORE_TTL = float(os.getenv('RECIPE_STORE_TTL', 7 * 24 * 60 * 60))
+# How long past expiry an entry may still be served while it is refreshed.
+RECIPE_STALE_TTL = float(os.getenv('RECIPE_STALE_TTL', 24 * 60 * 60))
+
+
+class CacheEntry:
+    __slots__ = ('value', 'size', 'stored_at', 'expires_at')
+
+    def __init__(self, value, size, stored_at, expires_at):
+        self.value = value
+        self.size = size
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+
+
+class RecipeCache:
+    # A byte-bounded LRU of serialized recipes. Entries are fresh for `ttl`
+    # seconds and may then be served stale for another `stale_ttl` seconds;
+    # dead entries are dropped lazily on lookup or when the LRU end is trimmed.
+    def __init__(self, max_bytes=RECIPE_CACHE_MAX_BYTES, ttl=RECIPE_CACHE_TTL, stale_ttl=RECIPE_STALE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def lookup(self, key):
+        # Returns (value, stale) or None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at + self.stale_ttl <= now:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry.expires_at <= now:
+                self.stale_hits += 1
+                return entry.value, True
+            self.hits += 1
+            return entry.value, False
+
+    def set(self, key, value, ttl=None):
+        size = len(key) + len(value.encode('utf-8') if isinstance(value, str) else value)
+        if size > self.max_bytes:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CacheEntry(value, size, now, now + (self.ttl if ttl is None else ttl))
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def clear(self):
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            return count
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "stale_ttl": self.stale_ttl,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def entries(self, limit=100):
+        # Most recently used first
+        now = time.monotonic()
+        with self._lock:
+            items = list(reversed(self._entries.items()))[:limit]
+        return [{
+            "key": key,
+            "bytes": entry.size,
+            "age": round(now - entry.stored_at, 1),
+            "expires_in": round(entry.expires_at - now, 1),
+        } for key, entry in items]
+
+
+class StoredRecipe:
+    __slots__ = ('payload', 'expires_in', 'etag', 'last_modified')
+
+    def __init__(self, payload, expires_in, etag=None, last_modified=None):
+        self.payload = payload
+        self.expires_in = expires_in
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class RecipeStore:
+    # Durable recipe results in SQLite, shared by every worker process on the
+    # host. WAL mode lets readers proceed while another worker writes.
+    # Freshness uses wall-clock time since entries outlive the process; rows
+    # are kept for `stale_ttl` past expiry so they can be served stale.
+    # Nothing is opened until first use, and then one connection per thread
+    # per process, so forked workers never share their parent's.
+    PURGE_EVERY = 1000
+
+    def __init__(self, path=RECIPE_STORE_PATH, ttl=RECIPE_STORE_TTL, stale_ttl=RECIPE_STALE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS recipes ('
+                ' key TEXT PRIMARY KEY,'
+                ' payload TEXT NOT NULL,'
+                ' stored_at REAL NOT NULL,'
+                ' expires_at REAL NOT NULL,'
+                ' etag TEXT,'
+                ' last_modified TEXT)')
+            columns = {row[1] for row in connection.execute('PRAGMA table_info(recipes)')}
+            for column in ('etag', 'last_modified'):
+                if column not in columns:
+                    connection.execute(f'ALTER TABLE recipes ADD COLUMN {column} TEXT')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        # Returns StoredRecipe or None; its expires_in is negative for a
+        # stale row.
+        now = time.time()
+        row = self._connect().execute(
+            'SELECT payload, expires_at, etag, last_modified FROM recipes WHERE key = ? AND expires_at > ?',
+            (key, now - self.stale_ttl)).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        payload = row[0].encode('utf-8') if isinstance(row[0], str) else row[0]  # rows written as TEXT
+        return StoredRecipe(payload, row[1] - now, row[2], row[3])
+
+    def set(self, key, payload, ttl=None, etag=None, last_modified=None):
+        now = time.time()
+        self._connect().execute(
+            'INSERT OR REPLACE INTO recipes (key, payload, stored_at, expires_at, etag, last_modified)'
+            ' VALUES (?, ?, ?, ?, ?, ?)',
+            (key, payload, now, now + (self.ttl if ttl is None else ttl), etag, last_modified))
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % self.PURGE_EVERY == 0
+        if purge:
+            self.purge_expired()
+
+    def touch(self, key, ttl=None):
+        # Upstream confirmed the page is unchanged: extend freshness in place
+        now = time.time()
+        return self._connect().execute(
+            'UPDATE recipes SET stored_at = ?, expires_at = ? WHERE key = ?',
+            (now, now + (self.ttl if ttl is None else ttl), key)).rowcount > 0
+
+    def delete(self, key):
+        return self._connect().execute('DELETE FROM recipes WHERE key = ?', (key,)).rowcount > 0
+
+    def clear(self):
+        return self._connect().execute('DELETE FROM recipes').rowcount
+
+    def purge_expired(self):
+        return self._connect().execute(
+            'DELETE FROM recipes WHERE expires_at <= ?', (time.time() - self.stale_ttl,)).rowcount
+
+    def stats(self):
+        entries, size = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM recipes').fetchone()
+        with self._lock:
+            return {
+                "path": self.path,
+                "entries": entries,
+                "bytes": size,
+                "ttl": self.ttl,
+                "stale_ttl": self.stale_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+recipe_cache = RecipeCache()
+recipe_store = RecipeStore() if RECIPE_STORE_PATH else None
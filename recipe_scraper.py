@@ -1,18 +1,99 @@
-from flask import Flask, request, jsonify
-import requests
-from bs4 import BeautifulSoup
-import json
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+from http_client import (NotModified, Revalidation, fetch_page_async, fetch_stats, host_scheduler, retry_budget,
+                         revalidation)
+import asyncio
+import functools
+import hmac
+import os
+import queue
+import time
 from dotenv import load_dotenv
 from urllib.parse import urlparse
-from selenium import webdriver
+from browser_pool import BrowserPoolTimeout, get_pool
+from canonical_url import canonical_host, canonicalize, find_canonical_link
+from extractors import Extractor, ExtractorRegistry
+from compression import body_digest, choose_encoding, compress_stream, compressed_cache, encode_body, negotiate
+from jsonld import index_ld_json
+from recipe_cache import recipe_cache, recipe_store
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+import engine
+import json_codec
 
 
 load_dotenv()
 
+
+class CodecJSONProvider(DefaultJSONProvider):
+    # jsonify() and request.get_json() through json_codec; anything it can't
+    # encode still gets Flask's own encoder
+    def dumps(self, obj, **kwargs):
+        try:
+            return json_codec.dumps(obj, pretty='indent' in kwargs, sort_keys=self.sort_keys)
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return json_codec.loads(s)
+
+
 app = Flask(__name__)
+app.json = CodecJSONProvider(app)
+
+BATCH_MAX_URLS = int(os.getenv('BATCH_MAX_URLS', 500))
+# Process-wide cap on scrapes in flight for batch requests, and the cap for
+# any single domain within it.
+BATCH_MAX_PARALLEL = int(os.getenv('BATCH_MAX_PARALLEL', 32))
+BATCH_DOMAIN_PARALLEL = int(os.getenv('BATCH_DOMAIN_PARALLEL', 4))
+# After this many browser renders in a row, a domain that learned it needs
+# the browser is probed with a plain fetch again in case its pages changed.
+RENDER_REPROBE_EVERY = int(os.getenv('RENDER_REPROBE_EVERY', 25))
+# Background stale-while-revalidate refreshes allowed in flight per domain.
+REFRESH_DOMAIN_PARALLEL = int(os.getenv('REFRESH_DOMAIN_PARALLEL', 2))
+# How long a rendered page may take to expose its Recipe JSON-LD.
+RENDER_WAIT_TIMEOUT = float(os.getenv('RENDER_WAIT_TIMEOUT', 10))
+# Cache-Control max-age on /recipe responses, for clients and proxies.
+RECIPE_MAX_AGE = int(os.getenv('RECIPE_MAX_AGE', 60 * 60))
+
+# Bearer token for the /admin routes. Without one they only answer direct
+# requests from this machine, not ones relayed by a proxy or tunnel such as
+# ngrok.
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+LOOPBACK = ('127.0.0.1', '::1')
+FORWARDED_HEADERS = ('Forwarded', 'X-Forwarded-For', 'X-Real-IP')
+
+# Returns the text of every JSON-LD block, Recipe blocks first, once one of
+# them mentions a Recipe, or null so WebDriverWait keeps polling.
+FIND_RECIPE_LD_JSON = '''
+var nodes = document.querySelectorAll('script[type="application/ld+json"]');
+var recipes = [];
+var others = [];
+for (var i = 0; i < nodes.length; i++) {
+    var text = nodes[i].textContent;
+    if (/"@type"\\s*:\\s*(\\[[^\\]]*)?"Recipe"/.test(text)) {
+        recipes.push(text);
+    } else {
+        others.push(text);
+    }
+}
+return recipes.length ? recipes.concat(others) : null;
+'''
+
+
+class RecipeError(Exception):
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
 
 
 class Recipe:
+    # A flat record; the compact JSON form is built once and reused for the
+    # cache, the store and every response.
+    __slots__ = ('name', 'description', 'prepTime', 'cookTime', 'servings', 'ingredients',
+                 'instructionsList', 'imageUrl', 'source', 'canonical_url', '_json')
+
     def __init__(self, name, description, prepTime, cookTime, servings, ingredients, instructionsList, imageUrl, source):
         self.name = name
         self.description = description
@@ -23,9 +104,11 @@ class Recipe:
         self.instructionsList = instructionsList
         self.imageUrl = imageUrl
         self.source = source
+        self.canonical_url = None
+        self._json = None
 
-    def to_json(self):
-        ordered_data = {
+    def to_dict(self):
+        return {
             "name": self.name,
             "description": self.description,
             "servings": self.servings,
@@ -36,7 +119,18 @@ class Recipe:
             "directions": self.instructionsList,
             "sources": self.source
         }
-        return json.dumps(ordered_data, sort_keys=False, indent=4)
+
+    def to_json(self, pretty=False):
+        # UTF-8 bytes
+        if pretty:
+            return json_codec.dumpb(self.to_dict(), pretty=True)
+        if self._json is None:
+            self._json = json_codec.dumpb(self.to_dict())
+        return self._json
+
+
+def pretty_json(payload):
+    return json_codec.dumpb(json_codec.loads(payload), pretty=True)
 
 
 def parse_duration(duration):
@@ -64,299 +158,629 @@ def recipe_api():
     url = request.args.get('url')
 
     if url:
-        return get_recipe_from_url(url)
+        try:
+            payload = engine.run(get_recipe_json(url))
+        except RecipeError as e:
+            return jsonify({"error": e.message}), e.status_code
+        except Exception as e:
+            return jsonify({"error": f"Error fetching recipe: {str(e)}"}), 502
+        status, body, headers = recipe_response(
+            payload, wants_pretty(), request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'))
+        return Response(body, status=status, headers=headers)
     else:
         return jsonify({"error": "No URL provided"}), 400
 
 
-def get_recipe_from_url(url):
-    domain = urlparse(url).netloc
-    if 'tasty.co' in domain:
-        return fetch_tasty_recipe(url)
-    elif 'resepichenom.com' in domain:
-        return fetch_chenom_recipe(url)
-    elif 'kingarthurbaking.com' in domain:
-        print('executed foodie crush addiction')
-        return fetch_kingarthurbaking_recipe(url)
+@app.route('/recipes/batch', methods=['POST'])
+def batch_recipe_api():
+    payload = request.get_json(silent=True) or {}
+    urls = payload.get('urls')
+
+    if not isinstance(urls, list) or not urls:
+        return jsonify({"error": "No URLs provided"}), 400
+
+    urls = dedupe_urls(urls)
+    if len(urls) > BATCH_MAX_URLS:
+        return jsonify({"error": f"Too many URLs, the limit is {BATCH_MAX_URLS}"}), 400
+
+    if wants_stream():
+        encoding = negotiate(request.headers.get('Accept-Encoding'))
+        lines = stream_batch(urls)
+        response = Response(compress_stream(lines, encoding) if encoding else lines,
+                            mimetype='application/x-ndjson')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+    return compressed_response(engine.run(scrape_batch(urls)), mimetype='application/json')
+
+
+def admin_only(view):
+    @functools.wraps(view)
+    def guarded(*args, **kwargs):
+        if ADMIN_TOKEN:
+            scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+            if scheme.lower() != 'bearer' or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+                return jsonify({"error": "Unauthorized"}), 401
+        elif request.remote_addr not in LOOPBACK or any(name in request.headers for name in FORWARDED_HEADERS):
+            return jsonify({"error": "Forbidden, set ADMIN_TOKEN to use the admin routes remotely"}), 403
+        return view(*args, **kwargs)
+    return guarded
+
+
+@app.route('/admin/stats')
+@admin_only
+def admin_stats_api():
+    return jsonify({
+        "browser_pool": get_pool().stats(),
+        "render_preferences": render_preferences.snapshot(),
+        "extractors": site_extractors.snapshot(),
+        "recipe_cache": recipe_cache.stats(),
+        "recipe_store": recipe_store.stats() if recipe_store else None,
+        "compressed_cache": compressed_cache.stats(),
+        "single_flight": recipe_flights.stats(),
+        "revalidation": revalidator.stats(),
+        "fetch": dict(fetch_stats),
+        "host_scheduler": host_scheduler.stats(),
+        "retry_budget": retry_budget.stats(),
+    })
+
+
+@app.route('/admin/cache', methods=['GET', 'DELETE'])
+@admin_only
+def admin_cache_api():
+    url = request.args.get('url')
+
+    if request.method == 'DELETE':
+        if url:
+            try:
+                key = canonicalize(url)
+            except ValueError as e:
+                return jsonify({"error": f"Invalid URL: {str(e)}"}), 400
+            purged = recipe_cache.delete(key)
+            if recipe_store:
+                purged = recipe_store.delete(key) or purged
+            return jsonify({"purged": 1 if purged else 0})
+        purged = recipe_cache.clear()
+        compressed_cache.clear()
+        if recipe_store:
+            purged = max(purged, recipe_store.clear())
+        return jsonify({"purged": purged})
+
+    limit = request.args.get('limit', 100, type=int)
+    return jsonify({
+        "stats": recipe_cache.stats(),
+        "store": recipe_store.stats() if recipe_store else None,
+        "entries": recipe_cache.entries(limit),
+    })
+
+
+def compressed_response(body, mimetype=None):
+    # gzip/brotli per the request's Accept-Encoding
+    encoding = choose_encoding(body, request.headers.get('Accept-Encoding'))
+    response = Response(encode_body(body, encoding), mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def etag_matches(if_none_match, etag):
+    # If-None-Match uses the weak comparison, so a W/ prefix is ignored
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+
+def recipe_response(payload, pretty, accept_encoding, if_none_match):
+    # Returns (status, body, headers) for a /recipe hit; shared with the ASGI
+    # route. The strong ETag is the payload's content hash, tagged with the
+    # representation, and a matching If-None-Match gets a 304 before anything
+    # is re-indented or compressed.
+    digest = body_digest(payload)
+    encoding = choose_encoding(payload, accept_encoding)
+    etag = '"%s%s%s"' % (digest, '-pretty' if pretty else '', f'-{encoding}' if encoding else '')
+    headers = [
+        ('ETag', etag),
+        ('Cache-Control', f'public, max-age={RECIPE_MAX_AGE}'),
+        ('Vary', 'Accept-Encoding'),
+    ]
+    if etag_matches(if_none_match, etag):
+        return 304, b'', headers
+    if pretty:
+        body = encode_body(pretty_json(payload), encoding)
     else:
-        print('executed default recipe')
-        return fetch_default_recipe(url)
+        body = encode_body(payload, encoding, digest)
+    if encoding:
+        headers.append(('Content-Encoding', encoding))
+    return 200, body, headers
+
 
+def wants_pretty():
+    return request.args.get('pretty', '').lower() in ('1', 'true', 'yes')
 
-def fetch_tasty_recipe(url):
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    script = soup.find('script', type='application/ld+json')
-    if script:
-        json_text = script.string.replace('\n', ' ').replace('\r', ' ')
+
+def wants_stream():
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def dedupe_urls(urls):
+    # Keeps the first spelling of each canonical URL
+    seen = set()
+    unique = []
+    for url in urls:
+        if not isinstance(url, str):
+            continue
+        url = url.strip()
+        if not url:
+            continue
+        try:
+            key = canonicalize(url)
+        except ValueError:
+            # Malformed, e.g. an unclosed IPv6 bracket; kept so it gets its
+            # own 400 entry
+            key = url
+        if key not in seen:
+            seen.add(key)
+            unique.append(url)
+    return unique
+
+
+class BatchLimiter:
+    # Semaphores are created lazily on the engine loop. Per-domain ones are
+    # dropped again once nothing holds or waits on them.
+    def __init__(self, max_parallel, domain_parallel):
+        self.max_parallel = max_parallel
+        self.domain_parallel = domain_parallel
+        self._global = None
+        self._domains = {}
+
+    async def __call__(self, domain, coro, limit=None):
+        # `limit` overrides domain_parallel for a site with its own policy
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.max_parallel)
+        entry = self._domains.get(domain)
+        if entry is None:
+            entry = self._domains[domain] = [asyncio.Semaphore(limit or self.domain_parallel), 0]
+        entry[1] += 1
         try:
-            data_list = json.loads(json_text)
-        except json.decoder.JSONDecodeError as e:
-            return jsonify({"error": f"Error decoding JSON: {str(e)}"}), 500
+            async with entry[0], self._global:
+                return await coro
+        finally:
+            # Cancelled while queued: the scrape never started
+            coro.close()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._domains[domain]
 
-        if isinstance(data_list, list):
-            data = next(
-                (item for item in data_list if item.get('@type') == 'Recipe'), {})
-        else:
-            data = data_list
-
-        if not data:
-            return jsonify({"error": "No recipe data found"}), 404
-
-        name = data.get('name', 'No name available')
-        description = data.get('description', 'No description available')
-        prep_time = parse_duration(
-            data.get('prepTime', 'No prep time available'))
-        cook_time = parse_duration(
-            data.get('cookTime', 'No cook time available'))
-        servings = data.get('recipeYield', 'No yield available')
-
-        # Handle image data
-        image_data = data.get('image', {})
-        if isinstance(image_data, list) and len(image_data) > 0:
-            image_url = image_data[0].get('url', 'No image available')
-        elif isinstance(image_data, dict):
-            image_url = image_data.get('url', 'No image available')
-        elif isinstance(image_data, str):
-            image_url = image_data
-        else:
-            image_url = 'No image available'
 
-        ingredients_list = data.get('recipeIngredient', [])
-        ingredients = []
-        for ingredient in ingredients_list:
-            if isinstance(ingredient, str):
-                ingredients.append(ingredient.strip())
+batch_limiter = BatchLimiter(BATCH_MAX_PARALLEL, BATCH_DOMAIN_PARALLEL)
 
-        instructions_data = data.get('recipeInstructions', [])
-        instructions_list = []
-        if isinstance(instructions_data, list):
-            for step in instructions_data:
-                if isinstance(step, dict) and 'text' in step:
-                    instructions_list.append(step['text'].strip())
-                elif isinstance(step, str):
-                    instructions_list.append(step.strip())
+
+async def scrape_result(url):
+    # Returns (status, JSON bytes). The stored recipe payload is spliced in
+    # as-is rather than decoded and encoded again.
+    try:
+        payload = await get_recipe_json(url, limiter=batch_limiter)
+    except RecipeError as e:
+        return e.status_code, json_codec.dumpb({"url": url, "status": e.status_code, "error": e.message})
+    except Exception as e:
+        return 502, json_codec.dumpb({"url": url, "status": 502, "error": f"Error fetching recipe: {str(e)}"})
+    return 200, b'{"url":%s,"status":200,"recipe":%s}' % (json_codec.dumpb(url), payload)
+
+
+async def scrape_batch(urls):
+    results = await asyncio.gather(*(scrape_result(url) for url in urls))
+    return b'{"count":%d,"results":[%s]}\n' % (len(results), b','.join(result for _, result in results))
+
+
+def stream_batch(urls):
+    # Emit one NDJSON line per URL in completion order. Finished futures are
+    # handed over through a queue and dropped once written, so memory stays
+    # flat however large the batch is.
+    started = time.monotonic()
+    completed = queue.SimpleQueue()
+    pending = set()
+    for url in urls:
+        future = engine.submit(scrape_result(url))
+        pending.add(future)
+        future.add_done_callback(completed.put)
+
+    succeeded = 0
+    try:
+        for _ in range(len(urls)):
+            future = completed.get()
+            pending.discard(future)
+            status, result = future.result()
+            if status == 200:
+                succeeded += 1
+            yield result + b'\n'
+        yield json_codec.dumpb({"summary": {
+            "count": len(urls),
+            "succeeded": succeeded,
+            "failed": len(urls) - succeeded,
+            "elapsed": round(time.monotonic() - started, 3),
+        }}) + b'\n'
+    finally:
+        # The client went away mid-stream: stop the scrapes nobody will read.
+        # A scrape another request is also waiting on keeps running for it.
+        for future in pending:
+            future.cancel()
+
+
+recipe_flights = engine.SingleFlight()
+
+
+class Revalidator:
+    # Refreshes stale recipes in the background while callers are served the
+    # stale copy. At most `domain_parallel` refreshes run per domain; further
+    # stale hits for that domain are skipped and retried on a later hit.
+    def __init__(self, domain_parallel=REFRESH_DOMAIN_PARALLEL):
+        self.domain_parallel = domain_parallel
+        self._pending = set()
+        self._domains = {}
+        self.scheduled = 0
+        self.refreshed = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def schedule(self, url, key):
+        if key in self._pending:
+            return
+        domain = canonical_host(urlparse(url).netloc)[0]
+        if self._domains.get(domain, 0) >= self.domain_parallel:
+            self.skipped += 1
+            return
+        self._pending.add(key)
+        self._domains[domain] = self._domains.get(domain, 0) + 1
+        self.scheduled += 1
+        asyncio.ensure_future(self._refresh(url, key, domain))
+
+    async def _refresh(self, url, key, domain):
+        # A flight of its own: the stale hit that scheduled this refresh may
+        # come from inside the foreground load for `key`, and joining that
+        # would just hand back the stale payload.
+        try:
+            await recipe_flights.do(('refresh', key), lambda: load_recipe_json(url, key, revalidate=True))
+        except Exception as e:
+            # Keep serving the stale copy; the next stale hit tries again
+            self.failed += 1
+            print(f'revalidation of {url} failed: {e}')
         else:
-            # assume it's a string or another simple structure
-            instructions_list = [instructions_data]
+            self.refreshed += 1
+        finally:
+            self._pending.discard(key)
+            self._domains[domain] -= 1
+            if not self._domains[domain]:
+                del self._domains[domain]
+
+    def stats(self):
+        return {
+            "in_flight": len(self._pending),
+            "domain_parallel": self.domain_parallel,
+            "scheduled": self.scheduled,
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+        }
 
-        recipe = Recipe(name, description, prep_time, cook_time, servings,
-                        ingredients, instructions_list, image_url, response.url)
-        return recipe.to_json()
-    else:
-        return jsonify({"error": "No recipe data found"}), 404
 
+revalidator = Revalidator()
 
-def fetch_chenom_recipe(url):
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    script = soup.find('script', type='application/ld+json')
-    if script:
-        json_text = script.string.replace('\n', ' ').replace('\r', ' ')
-        try:
-            data_list = json.loads(json_text)
-        except json.decoder.JSONDecodeError as e:
-            return jsonify({"error": f"Error decoding JSON: {str(e)}"}), 500
 
-        if isinstance(data_list, list):
-            data = next(
-                (item for item in data_list if item.get('@type') == 'Recipe'), {})
-        else:
-            data = data_list
-
-        if not data:
-            return jsonify({"error": "No recipe data found"}), 404
-
-        name = data.get('name', 'No name available')
-        description = data.get('description', 'No description available')
-        prep_time = parse_duration(
-            data.get('prepTime', 'No prep time available'))
-        cook_time = parse_duration(
-            data.get('cookTime', 'No cook time available'))
-        servings = data.get('recipeYield', 'No yield available')
-
-        # Handle image data
-        image_data = data.get('image', {})
-        if isinstance(image_data, list) and len(image_data) > 0:
-            image_url = image_data[0].get('url', 'No image available')
-        elif isinstance(image_data, dict):
-            image_url = image_data.get('url', 'No image available')
-        elif isinstance(image_data, str):
-            image_url = image_data
-        else:
-            image_url = 'No image available'
+async def get_recipe_json(url, limiter=None):
+    # Serialized recipe for `url`, read through the in-process cache and then
+    # the on-disk store shared with other workers. Stale entries are served
+    # immediately and refreshed in the background. Concurrent misses for the
+    # same canonical URL share one load, and only real scrapes go through
+    # `limiter`.
+    try:
+        key = canonicalize(url)
+    except ValueError as e:
+        raise RecipeError(f"Invalid URL: {str(e)}", 400)
+    cached = recipe_cache.lookup(key)
+    if cached is not None:
+        payload, stale = cached
+        if stale:
+            revalidator.schedule(url, key)
+        return payload
+    return await recipe_flights.do(key, lambda: load_recipe_json(url, key, limiter))
+
+
+async def load_recipe_json(url, key, limiter=None, revalidate=False):
+    stored = None
+    if recipe_store:
+        stored = await engine.run_blocking(recipe_store.get, key)
+        if stored is not None and (stored.expires_in > 0 or not revalidate):
+            recipe_cache.set(key, stored.payload, ttl=min(recipe_cache.ttl, stored.expires_in))
+            if stored.expires_in <= 0:
+                revalidator.schedule(url, key)
+            return stored.payload
+
+    # A stale stored copy lets the refetch be conditional: on 304 Not Modified
+    # the stored extraction is reused and only its freshness is extended.
+    conditional = Revalidation(url, stored.etag, stored.last_modified) if stored else Revalidation(url)
+    extractor = site_extractors.lookup(url)
+    token = revalidation.set(conditional)
+    try:
+        scrape = get_recipe_from_url(url, extractor)
+        if limiter is not None:
+            scrape = limiter(canonical_host(urlparse(url).netloc)[0], scrape, extractor.concurrency)
+        recipe = await scrape
+    except NotModified:
+        await engine.run_blocking(recipe_store.touch, key, extractor.cache_ttl)
+        recipe_cache.set(key, stored.payload, ttl=extractor.cache_ttl)
+        return stored.payload
+    finally:
+        revalidation.reset(token)
+
+    payload = recipe.to_json()
+    # Also file the result under the page's own canonical URL so other
+    # spellings that redirect or declare the same canonical page hit.
+    alias = canonical_alias(recipe)
+    keys = {key, alias} if alias else {key}
+    for alias in keys:
+        recipe_cache.set(alias, payload, ttl=extractor.cache_ttl)
+        if recipe_store:
+            await engine.run_blocking(
+                recipe_store.set, alias, payload, extractor.cache_ttl,
+                conditional.response_etag, conditional.response_last_modified)
+    return payload
+
+
+def canonical_alias(recipe):
+    # The cache key for the canonical URL a page declares, provided it is on
+    # the site that was actually fetched: the same host, or a host the same
+    # site extractor serves. Any other page could otherwise plant its recipe
+    # under a URL it does not own.
+    if not recipe.canonical_url:
+        return None
+    canonical = urlparse(recipe.canonical_url)
+    if canonical.scheme not in ('http', 'https'):
+        return None
+    fetched_host = canonical_host(urlparse(recipe.source).netloc)[0]
+    if canonical_host(canonical.netloc)[0] != fetched_host:
+        extractor = site_extractors.lookup(recipe.canonical_url)
+        if extractor is site_extractors.default or extractor is not site_extractors.lookup(recipe.source):
+            return None
+    return canonicalize(recipe.canonical_url)
+
+
+async def get_recipe_from_url(url, extractor=None):
+    extractor = extractor or site_extractors.lookup(url)
+    print(f'executed {extractor.name} recipe')
+    return await extractor.extract(url)
+
+
+class RenderPreferences:
+    # Learns per domain whether a plain fetch already carries the Recipe
+    # JSON-LD. A domain counts as needing the browser only once a render found
+    # a recipe the static page did not have.
+    def __init__(self, reprobe_every=RENDER_REPROBE_EVERY, weight=0.3):
+        self.reprobe_every = reprobe_every
+        self.weight = weight
+        self._domains = {}
+
+    def _state(self, domain):
+        return self._domains.setdefault(domain, {"score": 0.0, "static": 0, "rendered": 0, "since_probe": 0})
+
+    def needs_render(self, domain):
+        state = self._state(domain)
+        if state["score"] <= 0.5:
+            return False
+        state["since_probe"] += 1
+        if state["since_probe"] >= self.reprobe_every:
+            state["since_probe"] = 0
+            return False
+        return True
+
+    def record(self, domain, rendered):
+        state = self._state(domain)
+        state["rendered" if rendered else "static"] += 1
+        state["score"] += self.weight * ((1.0 if rendered else 0.0) - state["score"])
+
+    def snapshot(self):
+        return {domain: dict(state, needs_render=state["score"] > 0.5)
+                for domain, state in list(self._domains.items())}
+
+
+render_preferences = RenderPreferences()
+
+
+def render_page(url):
+    try:
+        with get_pool().lease() as driver:
+            driver.get(url)  # Load the URL in the browser
+            try:
+                blocks = WebDriverWait(driver, RENDER_WAIT_TIMEOUT, poll_frequency=0.1).until(
+                    lambda d: d.execute_script(FIND_RECIPE_LD_JSON))
+            except TimeoutException:
+                # Get the page source after JavaScript has been executed
+                return driver.page_source, driver.current_url
+            # The recipe is in the DOM: stop whatever is still loading and hand
+            # back just the JSON-LD blocks instead of the whole page source.
+            driver.execute_script('window.stop();')
+            html = ''.join(f'<script type="application/ld+json">{block}</script>' for block in blocks)
+            return html, driver.current_url
+    except BrowserPoolTimeout as e:
+        raise RecipeError(f"Renderer busy: {str(e)}", 503)
+
+
+class RecipeExtractor(Extractor):
+    # The staged pipeline every site goes through: fetch the page (plain
+    # request and/or browser, per `renderer`), locate the Recipe JSON-LD,
+    # normalize its fields and build the Recipe. Locate, normalize and build
+    # run together on the parse executor. Sites override the field hooks
+    # where their markup differs.
+    name = 'default'
+
+    async def extract(self, url):
+        domain = canonical_host(urlparse(url).netloc)[0]
+        static_missed = False
+        if self.renderer == 'static' or (self.renderer == 'auto' and not render_preferences.needs_render(domain)):
+            started = time.perf_counter()
+            page = await fetch_page_async(url, self.timeout)
+            self.record('fetch', time.perf_counter() - started)
+            self.check_status(page)
+            try:
+                recipe = await self.parse_page(page.text, page.url)
+            except RecipeError as e:
+                # Only 'auto' sites escalate, and only when a good page had no
+                # recipe; an error page says nothing about rendering
+                if self.renderer == 'static' or e.status_code != 404:
+                    raise
+                static_missed = True
+            else:
+                if self.renderer == 'auto':
+                    render_preferences.record(domain, rendered=False)
+                return recipe
+
+        # Selenium is blocking, so the whole browser session runs on the I/O
+        # pool. A render is paced per host like any fetch, and waits out a
+        # pause the host asked for.
+        started = time.perf_counter()
+        host = await host_scheduler.acquire(domain)
+        try:
+            page_source, current_url = await engine.run_blocking(render_page, url)
+        finally:
+            host_scheduler.release(host)
+        self.record('render', time.perf_counter() - started)
+        recipe = await self.parse_page(page_source, current_url)
+        if static_missed:
+            render_preferences.record(domain, rendered=True)
+        return recipe
+
+    def check_status(self, page):
+        # Upstream error pages are reported as such rather than searched for
+        # a recipe: throttling and server errors as 503, a missing page as
+        # 404, anything else as 502
+        status = page.status_code
+        if status < 400:
+            return
+        if status == 429 or status >= 500:
+            raise RecipeError(f"Upstream unavailable: HTTP {status}", 503)
+        raise RecipeError(f"Upstream error: HTTP {status}", 404 if status in (404, 410) else 502)
+
+    async def parse_page(self, html, page_url):
+        started = time.perf_counter()
+        try:
+            return await engine.run_cpu(self.parse, html, page_url)
+        finally:
+            self.record('parse', time.perf_counter() - started)
+
+    def parse(self, html, page_url):
+        data, graph = self.locate(html)
+        recipe = self.build(self.normalize(data, graph), page_url)
+        recipe.canonical_url = find_canonical_link(html, page_url) or page_url
+        return recipe
+
+    def locate(self, html):
+        # The Recipe node from any JSON-LD block on the page, plus the index
+        # of the page's other nodes so @id references can be followed
+        graph = index_ld_json(html)
+        data = graph.first('Recipe')
+        if data is None:
+            if graph.errors:
+                raise RecipeError(f"Error decoding JSON: {str(graph.errors[0])}", 500)
+            raise RecipeError("No recipe data found", 404)
+        return data, graph
+
+    def normalize(self, data, graph):
+        return {
+            "name": data.get('name', 'No name available'),
+            "description": data.get('description', 'No description available'),
+            "prepTime": self.duration(data.get('prepTime', 'No prep time available')),
+            "cookTime": self.duration(data.get('cookTime', 'No cook time available')),
+            "servings": self.servings(data.get('recipeYield', 'No yield available')),
+            "imageUrl": self.image(graph.resolve(data.get('image', {}))),
+            "ingredients": self.ingredients(data.get('recipeIngredient', [])),
+            "instructionsList": self.instructions(data.get('recipeInstructions', [])),
+        }
 
-        ingredients_list = data.get('recipeIngredient', [])
+    def build(self, fields, source_url):
+        return Recipe(source=source_url, **fields)
+
+    def duration(self, value):
+        return parse_duration(value)
+
+    def servings(self, value):
+        return value
+
+    def image(self, value):
+        if isinstance(value, list) and len(value) > 0:
+            value = value[0]
+        if isinstance(value, dict):
+            return value.get('url', 'No image available')
+        if isinstance(value, str):
+            return value
+        return 'No image available'
+
+    def ingredients(self, value):
+        # Sites put several ingredients into one comma-separated string, as a
+        # plain string or under an 'ingredient' key
+        if not isinstance(value, list):
+            value = [value]
         ingredients = []
-        if isinstance(ingredients_list, list):
-            for ingredient in ingredients_list:
-                if isinstance(ingredient, str):
-                    # Split the ingredients string by commas and strip any extra whitespace
-                    ingredients.extend(
-                        [ing.strip() for ing in ingredient.split(',') if ing.strip()])
-                elif isinstance(ingredient, dict):
-                    # Split the ingredients from the dict and strip any extra whitespace
-                    ingredients.extend([ing.strip() for ing in ingredient.get(
-                        'ingredient', '').split(',') if ing.strip()])
-        else:
-            ingredients.extend(
-                [ing.strip() for ing in ingredients_list.split(',') if ing.strip()])
-
-        # for ingredient in ingredients_list:
-        #     if isinstance(ingredient, dict):
-        #         ingredients.append(
-        #             {'ingredient': ingredient.get('ingredient', '').strip()})
-        #     elif isinstance(ingredient, str):
-        #         ingredients.append({'ingredient': ingredient.strip()})
+        for ingredient in value:
+            if isinstance(ingredient, dict):
+                ingredient = ingredient.get('ingredient', '')
+            if isinstance(ingredient, str):
+                ingredients.extend(ing.strip() for ing in ingredient.split(',') if ing.strip())
+        return ingredients
 
-        instructions_data = data.get('recipeInstructions', [])
-        instructions_list = []
-        if isinstance(instructions_data, list):
-            for step in instructions_data:
-                if isinstance(step, dict) and 'text' in step:
-                    instructions_list.append(step['text'].strip())
-                elif isinstance(step, str):
-                    instructions_list.append(step.strip())
-        else:
+    def instructions(self, value):
+        if not isinstance(value, list):
             # assume it's a string or another simple structure
-            instructions_list = [instructions_data]
+            return [value]
+        instructions_list = []
+        for step in value:
+            if isinstance(step, dict) and 'text' in step:
+                instructions_list.append(step['text'].strip())
+            elif isinstance(step, str):
+                instructions_list.append(step.strip())
+        return instructions_list
 
-        recipe = Recipe(name, description, prep_time, cook_time, servings,
-                        ingredients, instructions_list, image_url, response.url)
-        return recipe.to_json()
-    else:
-        return jsonify({"error": "No recipe data found"}), 404
 
+class TastyExtractor(RecipeExtractor):
+    name = 'tasty'
 
-def fetch_kingarthurbaking_recipe(url):
-    driver = webdriver.Chrome()
-    try:
-        driver.get(url)  # Load the URL in the browser
-        # Get the page source after JavaScript has been executed
-        page_source = driver.page_source
-        soup = BeautifulSoup(page_source, 'html.parser')
-        script = soup.find('script', type='application/ld+json')
-        if script:
-            json_text = script.string.strip()
-            data_list = json.loads(json_text)
-            # Find the recipe in the graph
-            if isinstance(data_list, dict) and '@graph' in data_list:
-                data = next(
-                    (item for item in data_list['@graph'] if item.get('@type') == 'Recipe'), None)
-            else:
-                data = data_list if isinstance(data_list, dict) and data_list.get(
-                    '@type') == 'Recipe' else None
-
-            if not data:
-                return jsonify({"error": "No recipe data found"}), 404
-
-            # Extract information
-            name = data.get('name', 'No name available')
-            description = data.get('description', 'No description available')
-            if 'recipeYield' in data and isinstance(data['recipeYield'], list) and len(data['recipeYield']) > 0:
-                # Get the first element of the list
-                servings = data['recipeYield'][0]
-            else:
-                # Default message if 'recipeYield' is not a list or is empty
-                servings = 'No yield available'
-            prep_time = data.get('prepTime', 'No prep time available')
-            cook_time = data.get('cookTime', 'No cook time available')
-            image_url = data.get('image', {}).get('url', 'No image available')
-            ingredients = data.get('recipeIngredient', [])
-
-            instructions_data = data.get('recipeInstructions', [])
-            instructions_list = []
-            if isinstance(instructions_data, list):
-                for step in instructions_data:
-                    if isinstance(step, dict) and 'text' in step:
-                        instructions_list.append(step['text'].strip())
-                    elif isinstance(step, str):
-                        instructions_list.append(step.strip())
-            else:
-                # assume it's a string or another simple structure
-                instructions_list = [instructions_data]
+    def ingredients(self, value):
+        if not isinstance(value, list):
+            value = [value]
+        return [ingredient.strip() for ingredient in value if isinstance(ingredient, str)]
 
-            recipe = Recipe(name, description, prep_time, cook_time, servings,
-                            ingredients, instructions_list, image_url, driver.current_url)
-            return recipe.to_json()
-        else:
-            return jsonify({"error": "No recipe data found"}), 404
-    finally:
-        driver.quit()  # Properly close the WebDriver
 
+class ChenomExtractor(RecipeExtractor):
+    name = 'chenom'
 
-def fetch_default_recipe(url):
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    script = soup.find('script', type='application/ld+json')
-    if script:
-        json_text = script.string.replace('\n', ' ').replace('\r', ' ')
-        try:
-            data_list = json.loads(json_text)
-        except json.decoder.JSONDecodeError as e:
-            return jsonify({"error": f"Error decoding JSON: {str(e)}"}), 500
 
-        if isinstance(data_list, list):
-            data = next(
-                (item for item in data_list if item.get('@type') == 'Recipe'), {})
-        else:
-            data = data_list
-
-        if not data:
-            return jsonify({"error": "No recipe data found"}), 404
-
-        name = data.get('name', 'No name available')
-        description = data.get('description', 'No description available')
-        prep_time = parse_duration(
-            data.get('prepTime', 'No prep time available'))
-        cook_time = parse_duration(
-            data.get('cookTime', 'No cook time available'))
-        servings = data.get('recipeYield', 'No yield available')
-
-        # Handle image data
-        image_data = data.get('image', {})
-        if isinstance(image_data, list) and len(image_data) > 0:
-            image_url = image_data[0].get('url', 'No image available')
-        elif isinstance(image_data, dict):
-            image_url = image_data.get('url', 'No image available')
-        elif isinstance(image_data, str):
-            image_url = image_data
-        else:
-            image_url = 'No image available'
+class KingArthurBakingExtractor(RecipeExtractor):
+    name = 'kingarthurbaking'
+    renderer = 'auto'
 
-        ingredients_list = data.get('recipeIngredient', [])
-        ingredients = []
-        if isinstance(ingredients_list, list):
-            for ingredient in ingredients_list:
-                if isinstance(ingredient, str):
-                    # Split the ingredients string by commas and strip any extra whitespace
-                    ingredients.extend(
-                        [ing.strip() for ing in ingredient.split(',') if ing.strip()])
-                elif isinstance(ingredient, dict):
-                    # Split the ingredients from the dict and strip any extra whitespace
-                    ingredients.extend([ing.strip() for ing in ingredient.get(
-                        'ingredient', '').split(',') if ing.strip()])
-                else:
-                    ingredients.extend(
-                        [ing.strip() for ing in ingredients_list.split(',') if ing.strip()])
-
-        instructions_data = data.get('recipeInstructions', [])
-        instructions_list = []
-        if isinstance(instructions_data, list):
-            for step in instructions_data:
-                if isinstance(step, dict) and 'text' in step:
-                    instructions_list.append(step['text'].strip())
-                elif isinstance(step, str):
-                    instructions_list.append(step.strip())
-        else:
-            # assume it's a string or another simple structure
-            instructions_list = [instructions_data]
+    def duration(self, value):
+        # Served as the raw ISO 8601 duration
+        return value
 
-        recipe = Recipe(name, description, prep_time, cook_time, servings,
-                        ingredients, instructions_list, image_url, response.url)
-        return recipe.to_json()
-    else:
-        return jsonify({"error": "No recipe data found"}), 404
+    def servings(self, value):
+        if isinstance(value, list) and len(value) > 0:
+            # Get the first element of the list
+            return value[0]
+        return 'No yield available'
+
+    def ingredients(self, value):
+        return value
+
+
+site_extractors = ExtractorRegistry(RecipeExtractor())
+site_extractors.register(TastyExtractor(), domains=['tasty.co'])
+site_extractors.register(ChenomExtractor(), domains=['resepichenom.com'])
+site_extractors.register(KingArthurBakingExtractor(), domains=['kingarthurbaking.com'])
 
 
 if __name__ == '__main__':